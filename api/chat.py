@@ -1,14 +1,32 @@
 from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, Query
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from app.api.dependencies import get_current_user
 from app.core.chat_manager import ChatManager
-from app.services.auth_service import AuthService
+from app.services.admission_control import admission_controller, OverloadedError
+from app.services.file_storage import FileTooLargeError
+from app.utils.config import settings
 from app.utils.logger import logger
-import os
-import uuid
+from app.utils.tracing import span
+from typing import List, Optional
+import asyncio
+import json
 
 router = APIRouter()
 chat_manager = ChatManager()
-auth_scheme = HTTPBearer()
+
+class BatchItem(BaseModel):
+    id: Optional[str] = Field(None, description="Идентификатор элемента на стороне клиента")
+    thread_id: Optional[str] = Field(None, description="Тред; без него запрос выполняется без истории")
+    message: str
+    provider: Optional[str] = Field(None, description="Провайдер для запросов без треда")
+    temperature: Optional[float] = Field(None, ge=0.1, le=1.0)
+    top_p: Optional[float] = Field(None, ge=0.1, le=1.0)
+    max_tokens: Optional[int] = Field(None, gt=0, le=8192)
+
+class BatchRequest(BaseModel):
+    items: List[BatchItem] = Field(..., min_items=1)
+    concurrency: Optional[int] = Field(None, gt=0, description="Число одновременных запросов")
 
 @router.post("/threads/{thread_id}/messages")
 async def create_message(
@@ -18,32 +36,40 @@ async def create_message(
     top_p: Optional[float] = Query(None, ge=0.1, le=1.0, description="Кумулятивная вероятность"),
     max_tokens: Optional[int] = Query(None, gt=0, le=8192, description="Макс. количество токенов"),
     file: UploadFile = File(None),
-    token: HTTPAuthorizationCredentials = Depends(auth_scheme)
+    files: List[UploadFile] = File(None, description="Несколько вложений"),
+    user_id: str = Depends(get_current_user)
 ):
+    uploads = ([file] if file else []) + (files or [])
+    if len(uploads) > settings.MAX_ATTACHMENTS:
+        raise HTTPException(status_code=413, detail=f"Too many attachments: max {settings.MAX_ATTACHMENTS}")
+    
     try:
-        # Аутентификация пользователя
-        user_id = AuthService().get_current_user(token.credentials)
+        # Получаем информацию о треде для выбора провайдера
+        thread = await asyncio.to_thread(chat_manager.thread_storage.get_thread, thread_id)
+        provider_name = thread.get("provider", settings.DEFAULT_PROVIDER) if thread else settings.DEFAULT_PROVIDER
         
-        # Обработка файла
+        # Отклоняем запрос до загрузки файла, если провайдер перегружен
+        admission_controller.check(provider_name)
+        
+        # Обработка вложений
         file_data = None
-        if file:
-            # Сохраняем файл временно
-            file_path = f"{settings.STORAGE_PATH}/uploads/{uuid.uuid4()}_{file.filename}"
-            os.makedirs(os.path.dirname(file_path), exist_ok=True)
-            with open(file_path, "wb") as buffer:
-                buffer.write(await file.read())
-            
-            # Получаем информацию о треде для выбора провайдера
-            thread = chat_manager.thread_storage.get_thread(thread_id)
-            provider_name = thread.get("provider", settings.DEFAULT_PROVIDER)
-            
-            # Обрабатываем файл
-            file_data = await chat_manager.file_processor.process_file(
-                provider_name, 
-                file_path
-            )
+        if uploads:
+            stored_files = []
+            try:
+                # Сохраняем файлы (одинаковое содержимое хранится один раз)
+                with span("upload.write"):
+                    for upload in uploads:
+                        stored_files.append(await chat_manager.file_storage.save_upload(upload))
+                
+                # Обрабатываем файлы параллельно, результат уходит одним запросом к провайдеру
+                with span("file.process"):
+                    file_data = await chat_manager.process_uploads(provider_name, stored_files)
+            except Exception:
+                # Сообщение не будет записано - ссылки на файлы не нужны
+                chat_manager.release_uploads(stored_files)
+                raise
         
-        # Отправляем сообщение с параметрами
+        # Отправляем сообщение с параметрами; тред повторно не читается
         response = await chat_manager.send_message(
             thread_id, 
             user_id, 
@@ -51,10 +77,44 @@ async def create_message(
             file_data,
             temperature=temperature,
             top_p=top_p,
-            max_tokens=max_tokens
+            max_tokens=max_tokens,
+            thread=thread
         )
         return response
     
+    except OverloadedError:
+        raise
+    except FileTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         logger.error(f"Error sending message: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/messages/batch")
+async def create_messages_batch(
+    batch: BatchRequest,
+    user_id: str = Depends(get_current_user)
+):
+    """Пакетная отправка сообщений; результаты возвращаются в NDJSON по мере готовности"""
+    if len(batch.items) > settings.BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch too large: max {settings.BATCH_MAX_ITEMS} items"
+        )
+    
+    concurrency = min(
+        batch.concurrency or settings.BATCH_CONCURRENCY,
+        settings.BATCH_MAX_CONCURRENCY
+    )
+    
+    # Провайдер элемента определяется его тредом; треды читаются один раз
+    items = [item.dict() for item in batch.items]
+    threads = await chat_manager.get_batch_threads(items)
+    for provider_name in {chat_manager.batch_item_provider(item, threads) for item in items}:
+        admission_controller.check(provider_name)
+    
+    async def stream():
+        async for result in chat_manager.send_batch(user_id, items, concurrency, threads):
+            yield json.dumps(result, ensure_ascii=False, default=str) + "\n"
+    
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
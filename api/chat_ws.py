@@ -0,0 +1,172 @@
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from app.api.chat import chat_manager
+from app.services.admission_control import admission_controller, OverloadedError
+from app.services.auth_cache import auth_cache
+from app.utils.config import settings
+from app.utils.logger import logger
+from typing import Dict, Optional
+import asyncio
+import json
+import time
+
+"""
+WebSocket-канал чата. Протокол (JSON-кадры):
+
+клиент -> сервер
+    {"type": "auth", "token": "..."}                       первым кадром
+    {"type": "message", "request_id": "...", "thread_id": "...", "message": "...",
+     "temperature": ..., "top_p": ..., "max_tokens": ...}
+    {"type": "cancel", "request_id": "..."}
+    {"type": "ping"} / {"type": "pong"}
+
+сервер -> клиент
+    {"type": "auth_ok"}
+    {"type": "token", "request_id": "...", "thread_id": "...", "content": "..."}
+    {"type": "done", "request_id": "...", "thread_id": "...", "message": {...}}
+    {"type": "error", "request_id": "...", "detail": "...", "retry_after": ...}
+    {"type": "ping"} / {"type": "pong"}
+"""
+
+router = APIRouter()
+
+
+class ChatConnection:
+    """Одно WebSocket-соединение с несколькими одновременными запросами по разным тредам"""
+
+    def __init__(self, websocket: WebSocket, user_id: str):
+        self.websocket = websocket
+        self.user_id = user_id
+        # Ограниченная очередь отправки: медленный клиент притормаживает генерацию
+        self.outgoing: asyncio.Queue = asyncio.Queue(maxsize=settings.WS_SEND_QUEUE_SIZE)
+        self.requests: Dict[str, asyncio.Task] = {}
+        self.last_seen = time.monotonic()
+
+    async def send(self, frame: Dict):
+        await self.outgoing.put(frame)
+
+    async def run(self):
+        sender = asyncio.create_task(self._sender())
+        heartbeat = asyncio.create_task(self._heartbeat())
+        try:
+            await self._receiver()
+        finally:
+            for task in [sender, heartbeat, *self.requests.values()]:
+                task.cancel()
+            await asyncio.gather(sender, heartbeat, *self.requests.values(), return_exceptions=True)
+
+    async def _sender(self):
+        while True:
+            frame = await self.outgoing.get()
+            await self.websocket.send_text(json.dumps(frame, ensure_ascii=False, default=str))
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(settings.WS_HEARTBEAT_SECONDS)
+            if time.monotonic() - self.last_seen > settings.WS_IDLE_TIMEOUT_SECONDS:
+                logger.info(f"Closing idle WebSocket of user {self.user_id}")
+                await self.websocket.close(code=1001)
+                return
+            await self.send({"type": "ping"})
+
+    async def _receiver(self):
+        while True:
+            try:
+                frame = json.loads(await self.websocket.receive_text())
+            except (WebSocketDisconnect, RuntimeError):
+                # Клиент отключился или соединение закрыто по таймауту
+                return
+            except ValueError:
+                await self.send({"type": "error", "detail": "Invalid JSON"})
+                continue
+
+            self.last_seen = time.monotonic()
+            if not isinstance(frame, dict):
+                await self.send({"type": "error", "detail": "Frame must be a JSON object"})
+                continue
+            frame_type = frame.get("type")
+
+            if frame_type == "ping":
+                await self.send({"type": "pong"})
+            elif frame_type == "pong":
+                continue
+            elif frame_type == "cancel":
+                request_id = frame.get("request_id")
+                task = self.requests.get(request_id) if isinstance(request_id, str) else None
+                if task:
+                    task.cancel()
+            elif frame_type == "message":
+                await self._start_request(frame)
+            else:
+                await self.send({"type": "error", "detail": f"Unknown frame type: {frame_type}"})
+
+    async def _start_request(self, frame: Dict):
+        request_id = frame.get("request_id")
+        if not isinstance(request_id, str) or not request_id or request_id in self.requests:
+            await self.send({"type": "error", "request_id": request_id, "detail": "Missing or duplicate request_id"})
+            return
+        if len(self.requests) >= settings.WS_MAX_CONCURRENT_REQUESTS:
+            await self.send({"type": "error", "request_id": request_id, "detail": "Too many concurrent requests"})
+            return
+
+        task = asyncio.create_task(self._handle_message(request_id, frame))
+        self.requests[request_id] = task
+        task.add_done_callback(lambda _: self.requests.pop(request_id, None))
+
+    async def _handle_message(self, request_id: str, frame: Dict):
+        thread_id = frame.get("thread_id")
+        try:
+            thread = await asyncio.to_thread(chat_manager.thread_storage.get_thread, thread_id)
+            if thread:
+                admission_controller.check(thread.get("provider", settings.DEFAULT_PROVIDER))
+
+            async for event in chat_manager.stream_message(
+                thread_id,
+                self.user_id,
+                frame.get("message", ""),
+                temperature=frame.get("temperature"),
+                top_p=frame.get("top_p"),
+                max_tokens=frame.get("max_tokens"),
+                thread=thread
+            ):
+                await self.send({**event, "request_id": request_id, "thread_id": thread_id})
+        except asyncio.CancelledError:
+            raise
+        except OverloadedError as e:
+            await self.send({
+                "type": "error",
+                "request_id": request_id,
+                "detail": str(e),
+                "retry_after": e.retry_after
+            })
+        except Exception as e:
+            logger.error(f"WebSocket message error: {str(e)}")
+            await self.send({"type": "error", "request_id": request_id, "detail": str(e)})
+
+
+async def _authenticate(websocket: WebSocket) -> Optional[str]:
+    """Аутентификация первым кадром соединения"""
+    try:
+        frame = json.loads(await asyncio.wait_for(
+            websocket.receive_text(),
+            timeout=settings.WS_AUTH_TIMEOUT_SECONDS
+        ))
+        if frame.get("type") != "auth":
+            return None
+        await auth_cache.sync_revocations()
+        return auth_cache.get_current_user(frame.get("token", ""))
+    except Exception as e:
+        logger.error(f"WebSocket auth error: {str(e)}")
+        return None
+
+
+@router.websocket("/ws/chat")
+async def chat_websocket(websocket: WebSocket):
+    await websocket.accept()
+
+    user_id = await _authenticate(websocket)
+    if not user_id:
+        await websocket.close(code=4401)
+        return
+
+    await websocket.send_text(json.dumps({"type": "auth_ok"}))
+    await ChatConnection(websocket, user_id).run()
@@ -0,0 +1,15 @@
+from fastapi import Depends, HTTPException
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from app.services.auth_cache import auth_cache, TokenRevokedError
+from app.utils.tracing import span
+
+auth_scheme = HTTPBearer()
+
+async def get_current_user(token: HTTPAuthorizationCredentials = Depends(auth_scheme)) -> str:
+    """Идентификатор пользователя по Bearer-токену через кеш проверенных токенов"""
+    with span("auth"):
+        await auth_cache.sync_revocations()
+        try:
+            return auth_cache.get_current_user(token.credentials)
+        except TokenRevokedError as e:
+            raise HTTPException(status_code=401, detail=str(e))
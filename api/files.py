@@ -1,13 +1,16 @@
-from fastapi import APIRouter, UploadFile, File, Query, Depends
-from fastapi.security import HTTPBearer
-from app.core.chat_manager import ChatManager
-from app.services.auth_service import AuthService
+from fastapi import APIRouter, UploadFile, File, Query, Depends, HTTPException
+from app.api.chat import chat_manager
+from app.api.dependencies import get_current_user
+from app.services.admission_control import admission_controller, OverloadedError
+from app.services.file_storage import FileStorage, FileTooLargeError
+from app.services.image_jobs import image_analysis_queue
+from app.services.job_queue import QueueFullError
+from app.utils.config import settings
 from app.utils.logger import logger
-import os
-import uuid
+from app.utils.tracing import span
 
 router = APIRouter()
-auth_scheme = HTTPBearer()
+file_storage = FileStorage()
 
 @router.post("/analyze-image")
 async def analyze_image_endpoint(
@@ -15,32 +18,95 @@ async def analyze_image_endpoint(
     prompt: str = Query("Опиши изображение детально", description="Промпт для анализа"),
     temperature: float = Query(0.4, ge=0.1, le=1.0, description="Температура генерации"),
     max_tokens: int = Query(1024, gt=0, le=4096, description="Макс. количество токенов"),
-    token: HTTPAuthorizationCredentials = Depends(auth_scheme)
+    user_id: str = Depends(get_current_user)
 ):
     try:
-        # Аутентификация пользователя
-        user_id = AuthService().get_current_user(token.credentials)
+        admission_controller.check(settings.DEFAULT_PROVIDER)
         
-        # Сохраняем изображение
-        file_path = f"{settings.STORAGE_PATH}/uploads/{uuid.uuid4()}_{image.filename}"
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
-        with open(file_path, "wb") as buffer:
-            buffer.write(await image.read())
+        # Сохраняем изображение (одинаковое содержимое хранится один раз)
+        with span("upload.write"):
+            stored_file = await file_storage.save_upload(image)
         
-        # Анализируем изображение
-        chat_manager = ChatManager()
-        analysis = await chat_manager.analyze_image(
-            file_path,
-            prompt,
-            temperature,
-            max_tokens
-        )
+        # Анализируем изображение; ссылка держит файл только на время анализа
+        try:
+            analysis = await chat_manager.analyze_image(
+                stored_file["path"],
+                prompt,
+                temperature,
+                max_tokens
+            )
+        finally:
+            file_storage.release(stored_file["sha256"])
         
         return analysis
     
+    except OverloadedError:
+        raise
+    except FileTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         logger.error(f"Image analysis error: {str(e)}")
         return {
             "status": "error",
             "message": str(e)
-        }
\ No newline at end of file
+        }
+
+@router.post("/analyze-image/jobs", status_code=202)
+async def submit_image_analysis_job(
+    image: UploadFile = File(...),
+    prompt: str = Query("Опиши изображение детально", description="Промпт для анализа"),
+    temperature: float = Query(0.4, ge=0.1, le=1.0, description="Температура генерации"),
+    max_tokens: int = Query(1024, gt=0, le=4096, description="Макс. количество токенов"),
+    user_id: str = Depends(get_current_user)
+):
+    """Ставит анализ изображения в очередь и сразу возвращает идентификатор задачи"""
+    # Сохраняем изображение; ссылку снимает обработчик после анализа
+    try:
+        stored_file = await file_storage.save_upload(image)
+    except FileTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    
+    try:
+        job_id = await image_analysis_queue.submit(
+            {
+                "image_path": stored_file["path"],
+                "sha256": stored_file["sha256"],
+                "prompt": prompt,
+                "temperature": temperature,
+                "max_tokens": max_tokens
+            },
+            owner=user_id
+        )
+    except QueueFullError as e:
+        file_storage.release(stored_file["sha256"])
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    except Exception:
+        file_storage.release(stored_file["sha256"])
+        raise
+    
+    return {"job_id": job_id, "status": "queued"}
+
+@router.get("/analyze-image/jobs/{job_id}")
+async def get_image_analysis_job(
+    job_id: str,
+    wait: float = Query(0, ge=0, description="Ожидание результата в секундах (long-poll)"),
+    user_id: str = Depends(get_current_user)
+):
+    """Возвращает состояние задачи анализа, при wait > 0 дожидается ее завершения"""
+    job = await image_analysis_queue.get(job_id)
+    if not job or job["owner"] != user_id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    if wait:
+        job = await image_analysis_queue.wait(job_id, min(wait, settings.JOB_MAX_WAIT_SECONDS))
+        if not job:
+            raise HTTPException(status_code=404, detail="Job not found")
+    
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "result": job["result"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"]
+    }
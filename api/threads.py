@@ -0,0 +1,92 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import ORJSONResponse
+from app.api.chat import chat_manager
+from app.api.dependencies import get_current_user
+from app.storage.search_index import SearchUnavailableError
+from typing import Optional
+import asyncio
+import hashlib
+import orjson
+
+router = APIRouter()
+
+def _not_modified(request: Request, etag: str) -> bool:
+    """Проверяет заголовок If-None-Match (слабое сравнение)"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    candidates = {value.strip().removeprefix("W/") for value in header.split(",")}
+    return etag.removeprefix("W/") in candidates
+
+def _thread_etag(thread_id: str, version, pending=None) -> str:
+    return f'W/"{thread_id}:{version}+{pending}"' if pending else f'W/"{thread_id}:{version}"'
+
+@router.get("/threads")
+async def list_threads(
+    request: Request,
+    user_id: str = Depends(get_current_user)
+):
+    threads = await chat_manager.list_user_threads(user_id)
+
+    body = orjson.dumps(threads)
+    etag = f'W/"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(body, media_type="application/json", headers={"ETag": etag})
+
+@router.get("/threads/search")
+async def search_threads(
+    q: str = Query(..., min_length=1, description="Поисковый запрос"),
+    limit: int = Query(20, gt=0, le=100, description="Размер страницы"),
+    offset: int = Query(0, ge=0, description="Смещение"),
+    user_id: str = Depends(get_current_user)
+):
+    """Поиск по сообщениям тредов пользователя; возвращает сниппеты с идентификаторами тредов"""
+    try:
+        return await chat_manager.search_messages(user_id, q, limit, offset)
+    except SearchUnavailableError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+
+@router.post("/threads")
+async def create_thread(
+    title: str = Query("New Conversation", description="Заголовок треда"),
+    provider: Optional[str] = Query(None, description="Провайдер по умолчанию"),
+    user_id: str = Depends(get_current_user)
+):
+    thread_id = await chat_manager.create_thread(user_id, title, provider)
+    return ORJSONResponse({"thread_id": thread_id})
+
+@router.get("/threads/{thread_id}/messages")
+async def get_thread_messages(
+    thread_id: str,
+    request: Request,
+    user_id: str = Depends(get_current_user)
+):
+    """История треда; при совпадении ETag отдается 304 без чтения сообщений"""
+    meta = await asyncio.to_thread(chat_manager.thread_storage.get_thread_meta, thread_id)
+    if not meta or meta["user_id"] != user_id:
+        raise HTTPException(status_code=404, detail="Thread not found")
+
+    # Неперенесенные отложенные записи входят в ETag
+    etag = _thread_etag(thread_id, meta["version"], meta.get("pending"))
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    thread = await asyncio.to_thread(chat_manager.thread_storage.get_thread, thread_id)
+    if not thread or thread["user_id"] != user_id:
+        raise HTTPException(status_code=404, detail="Thread not found")
+
+    # ETag по версии фактически отданных данных
+    etag = _thread_etag(thread_id, thread.get("version", 0), thread.get("pending"))
+    return ORJSONResponse(thread["messages"], headers={"ETag": etag})
+
+@router.delete("/threads/{thread_id}")
+async def delete_thread(
+    thread_id: str,
+    user_id: str = Depends(get_current_user)
+):
+    if not await chat_manager.delete_thread(thread_id, user_id):
+        raise HTTPException(status_code=404, detail="Thread not found")
+    return {"status": "deleted"}
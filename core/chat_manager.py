@@ -1,10 +1,9 @@
-from app.providers.adapter import ProviderAdapter
-from app.storage.thread_storage import ThreadStorage
-from app.services.file_processor import FileProcessor
-from app.plugins.vision_plugin import VisionPlugin
 from app.utils.config import settings
 from app.utils.logger import logger
-from typing import Dict, List, Optional, Union
+from app.utils.tracing import span, traced
+from functools import cached_property
+from typing import AsyncIterator, Dict, List, Optional, Tuple, Union
+import asyncio
 import os
 
 """
@@ -16,22 +15,63 @@ manager.send_message("Привет!")
 class ChatManager:
     """Управление логикой чата и взаимодействием с провайдерами"""
     
+    # Хранилище, провайдеры и плагины создаются при первом обращении:
+    # импорт модуля и конструктор не тянут SQLAlchemy, Redis, gigachain и NumPy
     
-    def __init__(self):
-        self.thread_storage = ThreadStorage()
-        self.provider_adapter = ProviderAdapter()
-        self.file_processor = FileProcessor()
-        self.vision_plugin = VisionPlugin(self.provider_adapter)
+    @cached_property
+    def thread_storage(self):
+        from app.storage.thread_storage import ThreadStorage
+        storage = ThreadStorage()
+        if settings.WRITE_BEHIND_ENABLED:
+            from app.storage.write_behind import WriteBehindThreadStorage
+            return WriteBehindThreadStorage(storage)
+        return storage
     
+    @cached_property
+    def provider_adapter(self):
+        from app.providers.adapter import ProviderAdapter
+        return ProviderAdapter()
+    
+    @cached_property
+    def file_processor(self):
+        from app.services.file_processor import FileProcessor
+        return FileProcessor()
+    
+    @cached_property
+    def file_storage(self):
+        from app.services.file_storage import FileStorage
+        return FileStorage()
+    
+    @cached_property
+    def vision_plugin(self):
+        from app.plugins.vision_plugin import VisionPlugin
+        return VisionPlugin(self.provider_adapter)
+    
+    @cached_property
+    def rag_plugin(self):
+        from app.plugins.rag_plugin import RAGPlugin
+        return RAGPlugin(self.provider_adapter)
+    
+    def warmup(self):
+        """Заранее создает компоненты и клиенты провайдеров (при старте воркера)"""
+        self.thread_storage
+        self.file_processor
+        self.vision_plugin
+        if settings.RAG_ENABLED:
+            self.rag_plugin
+        self.provider_adapter.warmup()
+    
+    @traced("chat.send_message")
     async def send_message(
         self,
         thread_id: str,
         user_id: str,
         message: str,
-        file_data: Optional[dict] = None,
+        file_data: Optional[Union[dict, List[dict]]] = None,
         temperature: Optional[float] = None,
         top_p: Optional[float] = None,
-        max_tokens: Optional[int] = None
+        max_tokens: Optional[int] = None,
+        thread: Optional[Dict] = None
     ) -> dict:
         """
         Отправка сообщения и получение ответа от AI
@@ -39,29 +79,14 @@ class ChatManager:
         :param thread_id: Идентификатор треда
         :param user_id: Идентификатор пользователя
         :param message: Текст сообщения
-        :param file_data: Данные файла (если есть)
+        :param file_data: Данные файла или список данных нескольких файлов
         :param temperature: Температура генерации
         :param top_p: Кумулятивная вероятность
         :param max_tokens: Максимальное количество токенов
+        :param thread: Тред, уже прочитанный вызывающим (иначе читается заново)
         :return: Ответ AI
         """
-        # Получение треда
-        thread = self.thread_storage.get_thread(thread_id)
-        if not thread or thread["user_id"] != user_id:
-            raise ValueError("Thread not found or access denied")
-        
-        provider_name = thread.get("provider", settings.DEFAULT_PROVIDER)
-        
-        # Формирование сообщения пользователя
-        user_message = {"role": "user", "content": message}
-        if file_data:
-            user_message["file"] = file_data
-        
-        # Добавление сообщения в тред
-        self.thread_storage.add_message(thread_id, user_message)
-        
-        # Получение истории сообщений
-        messages = thread["messages"] + [user_message]
+        provider_name, messages = await self._prepare_turn(thread_id, user_id, message, file_data, thread)
         
         # Отправка запроса к провайдеру
         response = await self.provider_adapter.send_request(
@@ -81,10 +106,309 @@ class ChatManager:
         }
         
         # Добавление ответа AI в тред
-        self.thread_storage.add_message(thread_id, ai_message)
+        await asyncio.to_thread(self.thread_storage.add_message, thread_id, ai_message)
         
         return ai_message
     
+    async def stream_message(
+        self,
+        thread_id: str,
+        user_id: str,
+        message: str,
+        file_data: Optional[Union[dict, List[dict]]] = None,
+        temperature: Optional[float] = None,
+        top_p: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        thread: Optional[Dict] = None
+    ) -> AsyncIterator[Dict]:
+        """
+        Отправка сообщения с потоковым ответом AI
+        
+        :param thread_id: Идентификатор треда
+        :param user_id: Идентификатор пользователя
+        :param message: Текст сообщения
+        :param file_data: Данные файла или список данных нескольких файлов
+        :param temperature: Температура генерации
+        :param top_p: Кумулятивная вероятность
+        :param max_tokens: Максимальное количество токенов
+        :param thread: Тред, уже прочитанный вызывающим (иначе читается заново)
+        :return: Поток событий {"type": "token"} и завершающее {"type": "done"}
+        """
+        provider_name, messages = await self._prepare_turn(thread_id, user_id, message, file_data, thread)
+        
+        parts = []
+        params = {}
+        async for chunk in self.provider_adapter.stream_request(
+            provider_name,
+            messages,
+            temperature=temperature,
+            top_p=top_p,
+            max_tokens=max_tokens
+        ):
+            if chunk.get("content"):
+                parts.append(chunk["content"])
+                yield {"type": "token", "content": chunk["content"]}
+            if "params" in chunk:
+                params = chunk["params"]
+        
+        ai_message = {
+            "role": "assistant",
+            "content": "".join(parts),
+            "provider": provider_name,
+            "params": params
+        }
+        await asyncio.to_thread(self.thread_storage.add_message, thread_id, ai_message)
+        
+        yield {"type": "done", "message": ai_message}
+    
+    async def _prepare_turn(
+        self,
+        thread_id: str,
+        user_id: str,
+        message: str,
+        file_data: Optional[Union[dict, List[dict]]] = None,
+        thread: Optional[Dict] = None
+    ) -> Tuple[str, List[Dict]]:
+        """
+        Сохраняет сообщение пользователя и собирает контекст запроса к провайдеру.
+        Ссылки на загруженные файлы переходят к сообщению; если сообщение
+        не записано, они снимаются.
+        
+        :return: Пара (провайдер, сообщения для запроса)
+        """
+        try:
+            # Получение треда
+            if thread is None:
+                thread = await asyncio.to_thread(self.thread_storage.get_thread, thread_id)
+            if not thread or thread["user_id"] != user_id:
+                raise ValueError("Thread not found or access denied")
+            
+            provider_name = thread.get("provider", settings.DEFAULT_PROVIDER)
+            
+            # Формирование сообщения пользователя
+            user_message = {"role": "user", "content": message}
+            if file_data:
+                attachments = file_data if isinstance(file_data, list) else [file_data]
+                attachments = list(await asyncio.gather(
+                    *(self._index_file(thread_id, attachment) for attachment in attachments)
+                ))
+                if len(attachments) == 1:
+                    user_message["file"] = attachments[0]
+                else:
+                    user_message["files"] = attachments
+            
+            # Добавление сообщения в тред
+            await asyncio.to_thread(self.thread_storage.add_message, thread_id, user_message)
+        except Exception:
+            self.release_uploads(file_data if isinstance(file_data, list) else [file_data] if file_data else [])
+            raise
+        
+        # Получение истории сообщений
+        messages = await self._with_rag_context(thread_id, message, thread["messages"] + [user_message])
+        
+        return provider_name, messages
+    
+    async def _with_rag_context(self, thread_id: str, query: str, messages: List[Dict]) -> List[Dict]:
+        """Подмешивает перед последним сообщением релевантные фрагменты документов треда"""
+        if not settings.RAG_ENABLED:
+            return messages
+        with span("rag.retrieve"):
+            chunks = await self.rag_plugin.retrieve(thread_id, query)
+        context_message = self.rag_plugin.build_context_message(chunks)
+        if not context_message:
+            return messages
+        return messages[:-1] + [context_message, messages[-1]]
+    
+    async def process_upload(self, provider_name: str, stored_file: Dict) -> Dict:
+        """
+        Обрабатывает загруженный файл; результат сохраняется по хешу содержимого
+        и не вычисляется повторно для того же файла
+        
+        :param provider_name: Имя провайдера
+        :param stored_file: Сведения о файле из FileStorage.save_upload
+        :return: Данные файла для сообщения
+        """
+        kind = f"process_file:{provider_name}"
+        content = self.file_storage.get_derived(stored_file["sha256"], kind)
+        if content is None:
+            content = await self.file_processor.process_file(provider_name, stored_file["path"])
+            if content is not None:
+                self.file_storage.put_derived(stored_file["sha256"], kind, content)
+        
+        return {
+            "path": stored_file["path"],
+            "sha256": stored_file["sha256"],
+            "filename": stored_file["filename"],
+            "content": content
+        }
+    
+    async def process_uploads(self, provider_name: str, stored_files: List[Dict]) -> List[Dict]:
+        """
+        Параллельная обработка нескольких вложений с ограничением ATTACHMENT_CONCURRENCY
+        
+        :param provider_name: Имя провайдера
+        :param stored_files: Сведения о файлах из FileStorage.save_upload
+        :return: Данные файлов в исходном порядке
+        """
+        semaphore = asyncio.Semaphore(settings.ATTACHMENT_CONCURRENCY)
+        
+        async def process(stored_file: Dict) -> Dict:
+            async with semaphore:
+                return await self.process_upload(provider_name, stored_file)
+        
+        return list(await asyncio.gather(*(process(stored_file) for stored_file in stored_files)))
+    
+    def release_uploads(self, stored_files: List[Dict]):
+        """Снимает ссылки, взятые при сохранении загрузок, которые не попали в сообщение"""
+        for stored_file in stored_files:
+            if isinstance(stored_file, dict) and stored_file.get("sha256"):
+                try:
+                    self.file_storage.release(stored_file["sha256"])
+                except Exception as e:
+                    logger.error(f"Error releasing file {stored_file['sha256']}: {str(e)}")
+    
+    @staticmethod
+    def _attachments(message: Dict) -> List:
+        """Вложения сообщения: одно в file или несколько в files"""
+        if message.get("files"):
+            return message["files"]
+        return [message["file"]] if message.get("file") else []
+    
+    async def _index_file(self, thread_id: str, file_data: Union[str, dict]) -> Union[str, dict]:
+        """
+        Индексирует текст документа для RAG и возвращает ссылку на него
+        вместо полного текста, который иначе пересылался бы с каждым запросом
+        
+        :param thread_id: Идентификатор треда
+        :param file_data: Результат обработки файла
+        :return: Данные файла для сохранения в сообщении
+        """
+        if isinstance(file_data, dict):
+            text = file_data.get("content")
+        elif isinstance(file_data, str) and not os.path.isfile(file_data):
+            text = file_data
+        else:
+            # Путь к изображению обрабатывается мультимодальной моделью
+            text = None
+        
+        if not settings.RAG_ENABLED or not text or len(text) < settings.RAG_MIN_DOCUMENT_CHARS:
+            return file_data
+        
+        source = file_data.get("path") if isinstance(file_data, dict) else None
+        with span("rag.index_document"):
+            document = await self.rag_plugin.index_document(
+                thread_id,
+                text,
+                os.path.basename(source) if source else None
+            )
+        if isinstance(file_data, dict):
+            return {**{k: v for k, v in file_data.items() if k != "content"}, "rag": document}
+        return {"rag": document}
+    
+    async def send_batch(
+        self,
+        user_id: str,
+        items: List[Dict],
+        concurrency: Optional[int] = None,
+        threads: Optional[Dict[str, Dict]] = None
+    ) -> AsyncIterator[Dict]:
+        """
+        Пакетная отправка независимых сообщений с ограниченным параллелизмом.
+        Результаты отдаются в порядке завершения, запись в хранилище группируется.
+        
+        :param user_id: Идентификатор пользователя
+        :param items: Элементы пакета (thread_id, message, provider, параметры генерации)
+        :param concurrency: Максимальное число одновременных запросов к провайдерам
+        :param threads: Треды пакета, уже прочитанные вызывающим (get_batch_threads)
+        :return: Асинхронный поток результатов по элементам
+        """
+        semaphore = asyncio.Semaphore(concurrency or settings.BATCH_CONCURRENCY)
+        if threads is None:
+            threads = await self.get_batch_threads(items)
+        pending_writes: List[Tuple[str, Dict]] = []
+        
+        async def run(index: int, item: Dict):
+            async with semaphore:
+                try:
+                    return index, await self._send_batch_item(user_id, item, threads), None
+                except Exception as e:
+                    logger.error(f"Batch item {index} error: {str(e)}")
+                    return index, None, str(e)
+        
+        tasks = [asyncio.create_task(run(index, item)) for index, item in enumerate(items)]
+        try:
+            for future in asyncio.as_completed(tasks):
+                index, result, error = await future
+                if error is not None:
+                    yield {"index": index, "id": items[index].get("id"), "status": "error", "error": error}
+                    continue
+                
+                ai_message, writes = result
+                pending_writes.extend(writes)
+                if len(pending_writes) >= settings.BATCH_WRITE_SIZE:
+                    await asyncio.to_thread(self.thread_storage.add_messages, pending_writes)
+                    pending_writes = []
+                
+                yield {"index": index, "id": items[index].get("id"), "status": "ok", "response": ai_message}
+        finally:
+            for task in tasks:
+                task.cancel()
+            if pending_writes:
+                await asyncio.to_thread(self.thread_storage.add_messages, pending_writes)
+    
+    async def get_batch_threads(self, items: List[Dict]) -> Dict[str, Dict]:
+        """Треды элементов пакета одним запросом к хранилищу"""
+        thread_ids = list({item["thread_id"] for item in items if item.get("thread_id")})
+        return await asyncio.to_thread(self.thread_storage.get_threads, thread_ids)
+    
+    @staticmethod
+    def batch_item_provider(item: Dict, threads: Dict[str, Dict]) -> str:
+        """Провайдер элемента пакета: провайдер треда, для запросов без треда - из элемента"""
+        thread = threads.get(item.get("thread_id")) if item.get("thread_id") else None
+        if thread:
+            return thread.get("provider", settings.DEFAULT_PROVIDER)
+        return item.get("provider") or settings.DEFAULT_PROVIDER
+    
+    async def _send_batch_item(
+        self,
+        user_id: str,
+        item: Dict,
+        threads: Dict[str, Dict]
+    ) -> Tuple[Dict, List[Tuple[str, Dict]]]:
+        """Обрабатывает элемент пакета, возвращая ответ AI и сообщения для записи"""
+        thread_id = item.get("thread_id")
+        user_message = {"role": "user", "content": item["message"]}
+        
+        if thread_id:
+            thread = threads.get(thread_id)
+            if not thread or thread["user_id"] != user_id:
+                raise ValueError("Thread not found or access denied")
+            messages = await self._with_rag_context(
+                thread_id, item["message"], thread["messages"] + [user_message]
+            )
+        else:
+            # Запрос без треда: история не используется и не сохраняется
+            messages = [user_message]
+        provider_name = self.batch_item_provider(item, threads)
+        
+        response = await self.provider_adapter.send_request(
+            provider_name,
+            messages,
+            temperature=item.get("temperature"),
+            top_p=item.get("top_p"),
+            max_tokens=item.get("max_tokens")
+        )
+        
+        ai_message = {
+            "role": "assistant",
+            "content": response["content"],
+            "provider": provider_name,
+            "params": response.get("params", {})
+        }
+        
+        writes = [(thread_id, user_message), (thread_id, ai_message)] if thread_id else []
+        return ai_message, writes
+    
     async def analyze_image(
         self,
         image_path: str,
@@ -127,7 +451,8 @@ class ChatManager:
         :param provider: Провайдер по умолчанию
         :return: Идентификатор созданного треда
         """
-        return self.thread_storage.create_thread(
+        return await asyncio.to_thread(
+            self.thread_storage.create_thread,
             user_id=user_id,
             title=title,
             provider=provider
@@ -145,7 +470,7 @@ class ChatManager:
         :param user_id: Идентификатор пользователя
         :return: Список сообщений
         """
-        thread = self.thread_storage.get_thread(thread_id)
+        thread = await asyncio.to_thread(self.thread_storage.get_thread, thread_id)
         if not thread or thread["user_id"] != user_id:
             raise ValueError("Thread not found or access denied")
         return thread["messages"]
@@ -162,22 +487,29 @@ class ChatManager:
         :param user_id: Идентификатор пользователя
         :return: Статус удаления
         """
-        thread = self.thread_storage.get_thread(thread_id)
+        thread = await asyncio.to_thread(self.thread_storage.get_thread, thread_id)
         if not thread or thread["user_id"] != user_id:
             return False
         
-        # Удаление файлов треда
-        for message in thread["messages"]:
-            if "file" in message and "path" in message["file"]:
-                file_path = message["file"]["path"]
-                if os.path.exists(file_path):
-                    try:
-                        os.remove(file_path)
-                    except Exception as e:
-                        logger.error(f"Error deleting file {file_path}: {str(e)}")
+        # Удаление файлов треда: общие файлы удаляются при снятии последней ссылки
+        for file_data in (f for message in thread["messages"] for f in self._attachments(message)):
+            if not isinstance(file_data, dict):
+                continue
+            try:
+                if file_data.get("sha256"):
+                    self.file_storage.release(file_data["sha256"])
+                elif file_data.get("path") and os.path.exists(file_data["path"]):
+                    os.remove(file_data["path"])
+            except Exception as e:
+                logger.error(f"Error deleting file {file_data.get('path')}: {str(e)}")
+        
+        # Удаление векторного индекса документов треда; RAGPlugin (и NumPy)
+        # загружается, только если индекс у треда есть
+        if os.path.isdir(os.path.join(settings.STORAGE_PATH, "vectors", thread_id)):
+            await asyncio.to_thread(self.rag_plugin.delete_index, thread_id)
         
         # Удаление треда из хранилища
-        return self.thread_storage.delete_thread(thread_id)
+        return await asyncio.to_thread(self.thread_storage.delete_thread, thread_id)
     
     async def list_user_threads(
         self,
@@ -189,4 +521,22 @@ class ChatManager:
         :param user_id: Идентификатор пользователя
         :return: Список тредов
         """
-        return self.thread_storage.list_threads(user_id)
\ No newline at end of file
+        return self.thread_storage.list_threads(user_id)
+    
+    async def search_messages(
+        self,
+        user_id: str,
+        query: str,
+        limit: int = 20,
+        offset: int = 0
+    ) -> Dict:
+        """
+        Полнотекстовый поиск по сообщениям всех тредов пользователя
+        
+        :param user_id: Идентификатор пользователя
+        :param query: Поисковый запрос
+        :param limit: Размер страницы
+        :param offset: Смещение
+        :return: Страница результатов со сниппетами и идентификаторами тредов
+        """
+        return await asyncio.to_thread(self.thread_storage.search_messages, user_id, query, limit, offset)
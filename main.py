@@ -1,17 +1,28 @@
-from fastapi import FastAPI
+from app.utils.monitoring import setup_metrics, startup_profiler
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.middleware.cors import CORSMiddleware
-from app.api import chat, threads, auth
+from app.utils.compression import SelectiveCompressionMiddleware
 from app.utils.config import settings
 from app.utils.logger import logger
-from app.utils.monitoring import setup_metrics
+from app.utils.tracing import setup_tracing
 import uvicorn
 
+startup_profiler.mark("framework_import")
+
+from app.api import chat, chat_ws, threads, auth, files
+from app.services.admission_control import OverloadedError
+
+startup_profiler.mark("api_import")
+
 app = FastAPI(
     title="DataRex API",
     description="Multimodal Chatbot with GigaChain and YandexGPT",
     version="1.0.0",
     docs_url="/api/docs",
-    redoc_url="/api/redoc"
+    redoc_url="/api/redoc",
+    default_response_class=ORJSONResponse
 )
 
 # Настройка CORS
@@ -22,20 +33,90 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Сжатие ответов больше порога: brotli, если установлен brotli-asgi, иначе gzip.
+# Потоковые ответы (NDJSON, SSE) не сжимаются, чтобы фрагменты не буферизовались
+try:
+    from brotli_asgi import BrotliMiddleware as CompressionMiddleware
+except ImportError:
+    CompressionMiddleware = GZipMiddleware
+app.add_middleware(
+    SelectiveCompressionMiddleware,
+    compressor_class=CompressionMiddleware,
+    minimum_size=settings.COMPRESSION_MIN_SIZE
+)
+
+@app.exception_handler(OverloadedError)
+async def overloaded_handler(request: Request, exc: OverloadedError):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
 # Подключение эндпоинтов
 app.include_router(auth.router, prefix="/api")
 app.include_router(chat.router, prefix="/api")
+app.include_router(chat_ws.router, prefix="/api")
 app.include_router(threads.router, prefix="/api")
+app.include_router(files.router, prefix="/api")
 
 # Настройка метрик Prometheus
 setup_metrics(app)
 
+# Трассировка этапов запросов и журнал медленных запросов
+setup_tracing(app)
+
+startup_profiler.mark("app_setup")
+
 @app.on_event("startup")
 async def startup():
     logger.info("DataRex application started")
     # Инициализация подключений к БД
-    from app.storage.thread_storage import ThreadStorage
-    ThreadStorage()  # Автоматическое создание таблиц при необходимости
+    chat.chat_manager.thread_storage  # Автоматическое создание таблиц при необходимости
+    startup_profiler.mark("storage_init")
+    
+    # Повтор журнала отложенных записей и фоновый перенос в хранилище
+    if settings.WRITE_BEHIND_ENABLED:
+        await chat.chat_manager.thread_storage.start()
+    
+    # Перенос неактивных тредов из Redis в холодное хранилище
+    if settings.THREAD_COLD_STORAGE and chat.chat_manager.thread_storage.mode == "redis":
+        from app.storage.thread_tiering import ThreadTiering
+        app.state.thread_tiering = ThreadTiering(chat.chat_manager.thread_storage)
+        app.state.thread_tiering.start()
+    
+    # Общий токен доступа GigaChat: получение и обновление в фоне, старт не ждет OAuth
+    from app.providers.gigachat_token import get_token_manager, gigachat_enabled
+    if gigachat_enabled():
+        get_token_manager().start()
+        startup_profiler.mark("provider_auth")
+    
+    # Прогрев провайдеров и плагинов (иначе создаются при первом запросе)
+    if settings.WARMUP_ON_STARTUP:
+        chat.chat_manager.warmup()
+        startup_profiler.mark("warmup")
+    
+    # Пул обработчиков анализа изображений (0 - обработчики запущены отдельно)
+    if settings.IMAGE_ANALYSIS_WORKERS > 0:
+        from app.services.image_jobs import create_worker_pool
+        app.state.image_worker_pool = create_worker_pool()
+        app.state.image_worker_pool.start()
+    
+    startup_profiler.mark("ready")
+    startup_profiler.log_report(logger)
+
+@app.on_event("shutdown")
+async def shutdown():
+    pool = getattr(app.state, "image_worker_pool", None)
+    if pool:
+        await pool.stop()
+    tiering = getattr(app.state, "thread_tiering", None)
+    if tiering:
+        await tiering.stop()
+    from app.providers.gigachat_token import get_token_manager
+    await get_token_manager().stop()
+    if settings.WRITE_BEHIND_ENABLED:
+        await chat.chat_manager.thread_storage.stop()
 
 if __name__ == "__main__":
     uvicorn.run(
@@ -0,0 +1,125 @@
+# plugins/rag_plugin.py
+from app.providers.adapter import ProviderAdapter
+from app.storage.vector_storage import VectorStorage
+from app.utils.config import settings
+from app.utils.logger import logger
+from typing import Dict, List, Optional
+import hashlib
+import re
+import uuid
+import numpy as np
+
+
+class RAGPlugin:
+    """Плагин Retrieval-Augmented Generation по загруженным документам"""
+
+    def __init__(self, provider_adapter: ProviderAdapter):
+        self.provider_adapter = provider_adapter
+        self.vector_storage = VectorStorage()
+
+    def chunk_text(self, text: str) -> List[str]:
+        """
+        Разбивает текст на фрагменты по абзацам с перекрытием
+
+        :param text: Текст документа
+        :return: Список фрагментов
+        """
+        size = settings.RAG_CHUNK_SIZE
+        overlap = settings.RAG_CHUNK_OVERLAP
+        paragraphs = [p.strip() for p in re.split(r"\n\s*\n", text) if p.strip()]
+
+        chunks = []
+        current = ""
+        for paragraph in paragraphs:
+            # Слишком длинные абзацы режем по размеру фрагмента
+            while len(paragraph) > size:
+                if current:
+                    chunks.append(current)
+                    current = ""
+                chunks.append(paragraph[:size])
+                paragraph = paragraph[size - overlap:]
+
+            if current and len(current) + len(paragraph) + 2 > size:
+                chunks.append(current)
+                # Перекрытие берем только в пределах размера фрагмента
+                keep = min(overlap, size - len(paragraph) - 2)
+                current = current[-keep:] + "\n\n" + paragraph if keep > 0 else paragraph
+            else:
+                current = f"{current}\n\n{paragraph}" if current else paragraph
+
+        if current:
+            chunks.append(current)
+        return chunks
+
+    async def index_document(self, namespace: str, text: str, source: Optional[str] = None) -> Dict:
+        """
+        Разбивает документ на фрагменты и добавляет их в векторный индекс
+
+        :param namespace: Пространство имен индекса (тред или пользователь)
+        :param text: Текст документа
+        :param source: Имя исходного файла
+        :return: Сведения о проиндексированном документе
+        """
+        document_id = str(uuid.uuid4())
+        chunks = self.chunk_text(text)
+        vectors = await self.embed(chunks)
+        self.vector_storage.add(namespace, vectors, [
+            {"document_id": document_id, "source": source, "text": chunk}
+            for chunk in chunks
+        ])
+        logger.info(f"Indexed document {document_id} into {namespace}: {len(chunks)} chunks")
+        return {"document_id": document_id, "source": source, "chunks": len(chunks)}
+
+    async def retrieve(self, namespace: str, query: str, top_k: Optional[int] = None) -> List[Dict]:
+        """
+        Возвращает наиболее релевантные запросу фрагменты
+
+        :param namespace: Пространство имен индекса
+        :param query: Текст запроса
+        :param top_k: Количество фрагментов
+        :return: Фрагменты с оценкой близости
+        """
+        if not self.vector_storage.count(namespace):
+            return []
+        query_vector = (await self.embed([query]))[0]
+        return self.vector_storage.search(namespace, query_vector, top_k or settings.RAG_TOP_K)
+
+    def build_context_message(self, chunks: List[Dict]) -> Optional[Dict]:
+        """Формирует системное сообщение с найденными фрагментами"""
+        if not chunks:
+            return None
+        context = "\n\n---\n\n".join(
+            f"[{chunk.get('source') or 'документ'}]\n{chunk['text']}" for chunk in chunks
+        )
+        return {
+            "role": "system",
+            "content": f"Используй для ответа фрагменты загруженных документов:\n\n{context}"
+        }
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        """Вычисляет эмбеддинги через провайдера или локальную модель"""
+        provider_name = settings.RAG_EMBEDDING_PROVIDER
+        if provider_name == "local":
+            return self._local_embed(texts)
+        vectors = await self.provider_adapter.embed_texts(provider_name, texts)
+        return np.asarray(vectors, dtype=np.float32)
+
+    def _local_embed(self, texts: List[str]) -> np.ndarray:
+        """
+        Локальная заглушка эмбеддингов: хеширование слов и триграмм символов.
+        Не требует сети и подходит для поиска по лексическому совпадению.
+        """
+        dim = settings.RAG_LOCAL_EMBEDDING_DIM
+        vectors = np.zeros((len(texts), dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token in re.findall(r"\w+", text.lower()):
+                features = [token] + [token[i:i + 3] for i in range(max(len(token) - 2, 0))]
+                for feature in features:
+                    digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+                    value = int.from_bytes(digest, "little")
+                    sign = 1.0 if value & 1 else -1.0
+                    vectors[row, (value >> 1) % dim] += sign
+        return vectors
+
+    def delete_index(self, namespace: str):
+        self.vector_storage.delete(namespace)
@@ -2,6 +2,7 @@
 from app.providers.adapter import ProviderAdapter
 from app.utils.config import settings
 from app.utils.logger import logger
+from app.utils.tracing import traced, span
 from app.services.file_storage import FileStorage
 from typing import Dict, Optional, Union
 import httpx
@@ -19,6 +20,7 @@ class VisionPlugin:
         self.file_storage = FileStorage()
         self.supported_formats = ['.png', '.jpg', '.jpeg', '.webp', '.bmp']
     
+    @traced("vision.analyze_image")
     async def analyze_image(
         self, 
         image_path: str, 
@@ -43,17 +45,27 @@ class VisionPlugin:
             # Определение провайдера по конфигурации
             provider_name = settings.DEFAULT_PROVIDER
             
+            # Результат анализа того же изображения с теми же параметрами берем из хранилища
+            sha256 = self.file_storage.sha256_of(image_path)
+            kind = f"vision:{provider_name}:{temperature}:{max_tokens}:{prompt}"
+            cached = self.file_storage.get_derived(sha256, kind)
+            if cached is not None:
+                return cached
+            
             # Для GigaChain используем прямой мультимодальный запрос
             if provider_name == "gigachain":
-                return await self._analyze_with_gigachain(image_path, prompt, temperature, max_tokens)
+                result = await self._analyze_with_gigachain(image_path, prompt, temperature, max_tokens)
             
             # Для YandexGPT используем Vision API + YandexGPT
             elif provider_name == "yandexgpt":
-                return await self._analyze_with_yandex(image_path, prompt, temperature, max_tokens)
+                result = await self._analyze_with_yandex(image_path, prompt, temperature, max_tokens)
             
             # Для других провайдеров используем базовый метод
             else:
                 return await self._basic_image_analysis(image_path, prompt)
+            
+            self.file_storage.put_derived(sha256, kind, result)
+            return result
         
         except Exception as e:
             logger.error(f"Image analysis error: {str(e)}")
@@ -102,7 +114,8 @@ class VisionPlugin:
     ) -> Dict[str, Union[str, dict]]:
         """Анализ изображения с помощью Yandex Vision API + YandexGPT"""
         # Получаем описание изображения через Vision API
-        vision_description = await self._get_vision_description(image_path)
+        with span("vision.vision_api"):
+            vision_description = await self._get_vision_description(image_path)
         
         # Формируем запрос к YandexGPT
         messages = [
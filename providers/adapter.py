@@ -1,25 +1,58 @@
-from .gigachain_provider import GigaChainProvider
-from .yandexgpt_provider import YandexGPTProvider
+from .base_provider import BaseProvider
 from app.utils.config import settings
+from app.utils.tracing import traced
+from app.services.admission_control import admission_controller
+from typing import AsyncIterator, Dict, List
+
+def _gigachain_provider() -> BaseProvider:
+    from .gigachain_provider import GigaChainProvider
+    return GigaChainProvider()
+
+def _yandexgpt_provider() -> BaseProvider:
+    from .yandexgpt_provider import YandexGPTProvider
+    return YandexGPTProvider()
 
 class ProviderAdapter:
+    # Модули провайдеров импортируются, а клиенты создаются при первом обращении
+    provider_factories = {
+        "gigachain": _gigachain_provider,
+        "yandexgpt": _yandexgpt_provider
+    }
+
     def __init__(self):
-        self.providers = {
-            "gigachain": GigaChainProvider(),
-            "yandexgpt": YandexGPTProvider()
-        }
+        self.providers: Dict[str, BaseProvider] = {}
         self.default_provider = settings.DEFAULT_PROVIDER
 
     def get_provider(self, provider_name: str = None) -> BaseProvider:
         provider_name = provider_name or self.default_provider
-        if provider_name not in self.providers:
+        if provider_name not in self.provider_factories:
             raise ValueError(f"Provider {provider_name} not supported")
+        if provider_name not in self.providers:
+            self.providers[provider_name] = self.provider_factories[provider_name]()
         return self.providers[provider_name]
 
+    def warmup(self):
+        for provider_name in self.provider_factories:
+            self.get_provider(provider_name).warmup()
+
+    @traced("provider.send_request")
     async def send_request(self, provider_name: str, messages: List[Dict], **kwargs):
         provider = self.get_provider(provider_name)
-        return await provider.send_request(messages, **kwargs)
+        with admission_controller.track(provider.provider_name):
+            return await provider.send_request(messages, **kwargs)
+
+    async def stream_request(self, provider_name: str, messages: List[Dict], **kwargs) -> AsyncIterator[Dict]:
+        provider = self.get_provider(provider_name)
+        with admission_controller.track(provider.provider_name):
+            async for chunk in provider.stream_request(messages, **kwargs):
+                yield chunk
 
+    @traced("provider.process_file")
     async def process_file(self, provider_name: str, file_path: str, **kwargs):
         provider = self.get_provider(provider_name)
-        return await provider.process_file(file_path, **kwargs)
\ No newline at end of file
+        return await provider.process_file(file_path, **kwargs)
+
+    @traced("provider.embed_texts")
+    async def embed_texts(self, provider_name: str, texts: List[str]) -> List[List[float]]:
+        provider = self.get_provider(provider_name)
+        return await provider.embed_texts(texts)
@@ -1,5 +1,8 @@
 from abc import ABC, abstractmethod
-from typing import List, Dict, Any, Optional
+from typing import AsyncIterator, List, Dict, Any, Optional, Tuple
+import os
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
 
 class BaseProvider(ABC):
     provider_name: str
@@ -15,10 +18,38 @@ class BaseProvider(ABC):
     ) -> Dict[str, Any]:
         pass
 
+    async def stream_request(
+        self,
+        messages: List[Dict],
+        temperature: Optional[float] = None,
+        top_p: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        **kwargs
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Потоковый ответ: фрагменты {"content": ...}, последний содержит params.
+        По умолчанию ответ отдается одним фрагментом.
+        """
+        yield await self.send_request(
+            messages,
+            temperature=temperature,
+            top_p=top_p,
+            max_tokens=max_tokens,
+            **kwargs
+        )
+
     @abstractmethod
     async def process_file(self, file_path: str, **kwargs) -> Optional[str]:
         pass
 
+    def warmup(self):
+        """Предварительная инициализация клиентов и тяжелых импортов"""
+        pass
+
+    async def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """Эмбеддинги текстов (поддерживаются не всеми провайдерами)"""
+        raise NotImplementedError(f"Provider {self.provider_name} does not support embeddings")
+
     @abstractmethod
     def count_tokens(self, text: str) -> int:
         pass
@@ -27,6 +58,35 @@ class BaseProvider(ABC):
     def truncate_messages(self, messages: List[Dict], max_tokens: int) -> List[Dict]:
         pass
     
+    @staticmethod
+    def expand_attachments(message: Dict) -> Tuple[str, List[str]]:
+        """
+        Текст сообщения с извлеченным текстом вложений и пути изображений.
+        Вложения, проиндексированные для RAG, пропускаются: их фрагменты
+        передаются отдельным системным сообщением.
+        
+        :param message: Сообщение с полем file или files
+        :return: Пара (текст, пути изображений)
+        """
+        attachments = message.get('files') or ([message['file']] if message.get('file') else [])
+        parts = [message.get('content') or '']
+        images = []
+        for attachment in attachments:
+            if isinstance(attachment, dict):
+                if 'rag' in attachment:
+                    continue
+                data = attachment.get('content')
+                name = attachment.get('filename') or os.path.basename(attachment.get('path') or '')
+            else:
+                data, name = attachment, None
+            if not isinstance(data, str) or not data:
+                continue
+            if data.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(data):
+                images.append(data)
+            else:
+                parts.append(f"[Файл: {name}]\n{data}" if name else data)
+        return "\n\n".join(part for part in parts if part), images
+
     def _validate_params(
         self,
         temperature: Optional[float],
@@ -1,79 +1,213 @@
 from .base_provider import BaseProvider
+from .gigachat_token import get_token_manager
 from app.utils.config import settings
 from app.utils.logger import logger
 from gigachain import GigaChat, GigaChatMultimodal
+from typing import AsyncIterator, List, Dict, Any, Optional
 import os
 
 class GigaChainProvider(BaseProvider):
     provider_name = "gigachain"
 
     def __init__(self):
-        self.text_client = GigaChat(
-            credentials=settings.GIGA_API_KEY,
-            verify_ssl_certs=False,
-            model=settings.GIGA_MODEL
-        )
-        self.multimodal_client = GigaChatMultimodal(
-            credentials=settings.GIGA_API_KEY,
-            profanity_check=False
-        )
+        # Текстовые клиенты по моделям, создаются при первом обращении
+        self.text_clients: Dict[str, GigaChat] = {}
+        self._multimodal_client: Optional[GigaChatMultimodal] = None
+        # Клиент эмбеддингов создается при первом обращении
+        self.embeddings_client = None
+        # Общий токен доступа; клиенты пересоздаются при его смене
+        self.token_manager = get_token_manager(settings.GIGA_API_KEY)
+        self._clients_token: Optional[str] = None
 
-    async def send_request(
+    def warmup(self):
+        self.text_client
+        self.multimodal_client
+        import gigachain.document_loaders  # noqa: F401
+
+    def _auth_kwargs(self) -> Dict[str, Any]:
+        """
+        Параметры аутентификации клиентов: общий токен, если он получен,
+        иначе учетные данные (клиент получит токен сам)
+        """
+        token = self.token_manager.current()
+        if token != self._clients_token:
+            # Клиенты со старым токеном дорабатывают текущие запросы
+            self.text_clients = {}
+            self._multimodal_client = None
+            self.embeddings_client = None
+            self._clients_token = token
+        kwargs = {"credentials": settings.GIGA_API_KEY}
+        if token:
+            kwargs["access_token"] = token
+        return kwargs
+
+    @property
+    def multimodal_client(self) -> GigaChatMultimodal:
+        auth = self._auth_kwargs()
+        if self._multimodal_client is None:
+            self._multimodal_client = GigaChatMultimodal(
+                **auth,
+                profanity_check=False
+            )
+        return self._multimodal_client
+
+    @property
+    def text_client(self) -> GigaChat:
+        return self.get_text_client(settings.GIGA_MODEL)
+
+    def get_text_client(self, model: str) -> GigaChat:
+        """Возвращает клиент для модели из пула, создавая его при необходимости"""
+        auth = self._auth_kwargs()
+        client = self.text_clients.get(model)
+        if client is None:
+            client = GigaChat(
+                **auth,
+                verify_ssl_certs=False,
+                model=model
+            )
+            self.text_clients[model] = client
+        return client
+
+    def select_model(self, messages: List[Dict], requested_max_tokens: Optional[int] = None) -> tuple:
+        """
+        Выбор модели по сложности текущей реплики: размеру промпта,
+        наличию вложений и запрошенному max_tokens
+        
+        :param messages: Сообщения запроса
+        :param requested_max_tokens: max_tokens, явно запрошенный клиентом
+        :return: Пара (уровень, модель)
+        """
+        if not settings.GIGA_MODEL_TIERING:
+            return None, settings.GIGA_MODEL
+        
+        # Текущая реплика - сообщения после последнего ответа ассистента
+        turn = []
+        for msg in reversed(messages):
+            if msg.get('role') == 'assistant':
+                break
+            turn.append(msg)
+        
+        prompt_tokens = sum(self.count_tokens(self.expand_attachments(msg)[0]) for msg in turn)
+        has_attachments = any('file' in msg or 'files' in msg for msg in turn)
+        output_tokens = requested_max_tokens or 0
+        
+        tier = "lite"
+        if (has_attachments
+                or prompt_tokens > settings.GIGA_LITE_MAX_PROMPT_TOKENS
+                or output_tokens > settings.GIGA_LITE_MAX_OUTPUT_TOKENS):
+            tier = "pro"
+        if (prompt_tokens > settings.GIGA_PRO_MAX_PROMPT_TOKENS
+                or output_tokens > settings.GIGA_PRO_MAX_OUTPUT_TOKENS):
+            tier = "max"
+        
+        models = {
+            "lite": settings.GIGA_MODEL_LITE,
+            "pro": settings.GIGA_MODEL_PRO,
+            "max": settings.GIGA_MODEL_MAX
+        }
+        return tier, models[tier]
+
+    def _prepare_request(
         self,
         messages: List[Dict],
-        temperature: Optional[float] = None,
-        top_p: Optional[float] = None,
-        max_tokens: Optional[int] = None,
-        **kwargs
-    ) -> Dict[str, Any]:
+        temperature: Optional[float],
+        top_p: Optional[float],
+        max_tokens: Optional[int]
+    ) -> tuple:
+        """Выбор клиента, преобразование сообщений и параметров запроса"""
+        # Выбор модели по явно запрошенным параметрам, до подстановки значений по умолчанию
+        tier, model = self.select_model(messages, max_tokens)
+        
         # Применение значений по умолчанию и валидация
         temperature = temperature or settings.GIGA_TEMPERATURE
         top_p = top_p or settings.GIGA_TOP_P
         max_tokens = max_tokens or settings.GIGA_MAX_TOKENS
         temperature, top_p, max_tokens = self._validate_params(temperature, top_p, max_tokens)
         
+        # Преобразуем сообщения в формат GigaChain: текст вложений добавляется
+        # к содержимому сообщения, изображения передаются в поле image
+        giga_messages = []
+        for msg in messages:
+            content, images = self.expand_attachments(msg)
+            if 'image' in msg:
+                images.insert(0, msg['image'])
+            giga_message = {'role': msg['role'], 'content': content}
+            if images:
+                giga_message['image'] = images[0] if len(images) == 1 else images
+            giga_messages.append(giga_message)
+        
+        # Определяем, есть ли изображения
+        has_image = any('image' in msg for msg in giga_messages)
+        if has_image:
+            tier, model = None, settings.GIGA_MODEL
+            client = self.multimodal_client
+        else:
+            client = self.get_text_client(model)
+        
+        params = {
+            "temperature": temperature,
+            "top_p": top_p,
+            "max_tokens": max_tokens,
+            "model": model,
+            "tier": tier
+        }
+        return client, giga_messages, params
+
+    async def send_request(
+        self,
+        messages: List[Dict],
+        temperature: Optional[float] = None,
+        top_p: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        **kwargs
+    ) -> Dict[str, Any]:
         try:
-            # Определяем, есть ли изображения
-            has_image = any('image' in msg for msg in messages)
-            client = self.multimodal_client if has_image else self.text_client
-            
-            # Преобразуем сообщения в формат GigaChain
-            giga_messages = []
-            for msg in messages:
-                if 'image' in msg:
-                    giga_messages.append({
-                        'role': msg['role'],
-                        'content': msg.get('content', ''),
-                        'image': msg['image']
-                    })
-                else:
-                    giga_messages.append({
-                        'role': msg['role'],
-                        'content': msg['content']
-                    })
+            client, giga_messages, params = self._prepare_request(messages, temperature, top_p, max_tokens)
             
             # Отправляем запрос с параметрами
             response = await client.ainvoke(
                 giga_messages,
-                temperature=temperature,
-                top_p=top_p,
-                max_tokens=max_tokens
+                temperature=params["temperature"],
+                top_p=params["top_p"],
+                max_tokens=params["max_tokens"]
             )
             
             return {
                 "content": response.choices[0].message.content,
-                "model": settings.GIGA_MODEL,
+                "model": params["model"],
                 "provider": self.provider_name,
-                "params": {
-                    "temperature": temperature,
-                    "top_p": top_p,
-                    "max_tokens": max_tokens
-                }
+                "params": params
             }
         except Exception as e:
             logger.error(f"GigaChain request error: {str(e)}")
             raise
 
+    async def stream_request(
+        self,
+        messages: List[Dict],
+        temperature: Optional[float] = None,
+        top_p: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        **kwargs
+    ) -> AsyncIterator[Dict[str, Any]]:
+        try:
+            client, giga_messages, params = self._prepare_request(messages, temperature, top_p, max_tokens)
+            
+            async for chunk in client.astream(
+                giga_messages,
+                temperature=params["temperature"],
+                top_p=params["top_p"],
+                max_tokens=params["max_tokens"]
+            ):
+                content = chunk.choices[0].delta.content
+                if content:
+                    yield {"content": content}
+            
+            yield {"content": "", "model": params["model"], "provider": self.provider_name, "params": params}
+        except Exception as e:
+            logger.error(f"GigaChain stream error: {str(e)}")
+            raise
+
     async def process_file(self, file_path: str, **kwargs) -> Optional[str]:
         """Обработка файлов средствами экосистемы GigaChain"""
         from gigachain.document_loaders import TextLoader, PyPDFLoader
@@ -94,6 +228,17 @@ class GigaChainProvider(BaseProvider):
         
         return None
 
+    async def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """Эмбеддинги через GigaChat Embeddings API"""
+        auth = self._auth_kwargs()
+        if self.embeddings_client is None:
+            from gigachain.embeddings import GigaChatEmbeddings
+            self.embeddings_client = GigaChatEmbeddings(
+                **auth,
+                verify_ssl_certs=False
+            )
+        return await self.embeddings_client.aembed_documents(texts)
+
     def count_tokens(self, text: str) -> int:
         # Для GigaChain: 1 токен ≈ 4 символа
         return len(text) // 4
@@ -0,0 +1,159 @@
+import asyncio
+import hashlib
+import json
+import time
+import uuid
+from functools import cached_property
+from typing import Dict, Optional
+from app.utils.config import settings
+from app.utils.logger import logger
+
+# Снимает блокировку, только если она все еще принадлежит этому воркеру
+_RELEASE_LOCK = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+
+class GigaChatTokenManager:
+    """
+    Общий токен доступа GigaChat для одних учетных данных.
+
+    Токен хранится в Redis (giga_token:{id}) и используется всеми клиентами
+    и воркерами. Обмен учетных данных на токен выполняет только воркер,
+    захвативший блокировку giga_token:{id}:lock, остальные забирают
+    готовый токен из Redis. Фоновая задача обновляет токен заранее,
+    за GIGA_TOKEN_REFRESH_MARGIN_SECONDS до истечения, поэтому
+    пользовательские запросы не ждут аутентификации у провайдера.
+    """
+
+    def __init__(self, credentials: str, scope: Optional[str] = None):
+        self.credentials = credentials
+        self.scope = scope or settings.GIGA_SCOPE
+        key_id = hashlib.sha256(f"{credentials}:{self.scope}".encode("utf-8")).hexdigest()[:16]
+        self.token_key = f"giga_token:{key_id}"
+        self.lock_key = f"giga_token:{key_id}:lock"
+        self.access_token: Optional[str] = None
+        self.expires_at = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._refresh_lock = asyncio.Lock()
+
+    @cached_property
+    def redis(self):
+        from redis.asyncio import Redis
+        return Redis.from_url(str(settings.REDIS_URL))
+
+    def current(self) -> Optional[str]:
+        """Действующий токен без обращения к сети; None, если токена еще нет"""
+        if self.access_token and self.expires_at - time.time() > settings.GIGA_TOKEN_MIN_TTL_SECONDS:
+            return self.access_token
+        return None
+
+    def start(self):
+        """
+        Запускает фоновое получение и обновление токена.
+
+        Старт не ждет обмена учетных данных: до получения токена
+        клиенты аутентифицируются сами.
+        """
+        if self._task:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def _needs_refresh(self) -> bool:
+        return self.expires_at - time.time() <= settings.GIGA_TOKEN_REFRESH_MARGIN_SECONDS
+
+    async def refresh(self):
+        """Обновляет токен, если он близок к истечению"""
+        async with self._refresh_lock:
+            if not self._needs_refresh():
+                return
+            try:
+                if await self._load_shared() or await self._refresh_shared():
+                    return
+            except Exception as e:
+                # Без Redis каждый воркер получает свой токен
+                logger.error(f"GigaChat shared token error: {str(e)}")
+            self._set(*await self._fetch())
+
+    async def _load_shared(self) -> bool:
+        value = await self.redis.get(self.token_key)
+        if not value:
+            return False
+        token = json.loads(value)
+        self._set(token["access_token"], token["expires_at"])
+        return not self._needs_refresh()
+
+    async def _refresh_shared(self) -> bool:
+        lock_id = str(uuid.uuid4())
+        if not await self.redis.set(self.lock_key, lock_id, nx=True, ex=settings.GIGA_TOKEN_LOCK_SECONDS):
+            # Токен обновляет другой воркер - ждем его результата
+            deadline = time.monotonic() + settings.GIGA_TOKEN_LOCK_SECONDS
+            while time.monotonic() < deadline:
+                await asyncio.sleep(0.5)
+                if await self._load_shared():
+                    return True
+            return False
+
+        try:
+            access_token, expires_at = await self._fetch()
+            self._set(access_token, expires_at)
+            ttl = int(expires_at - time.time())
+            if ttl > 0:
+                await self.redis.set(
+                    self.token_key,
+                    json.dumps({"access_token": access_token, "expires_at": expires_at}),
+                    ex=ttl
+                )
+            return True
+        finally:
+            await self.redis.eval(_RELEASE_LOCK, 1, self.lock_key, lock_id)
+
+    async def _fetch(self) -> tuple:
+        """Обмен учетных данных на токен доступа (OAuth)"""
+        from gigachat import GigaChat as GigaChatAPI
+        async with GigaChatAPI(credentials=self.credentials, scope=self.scope, verify_ssl_certs=False) as client:
+            token = await client.aget_token()
+        logger.info("GigaChat access token refreshed")
+        # expires_at приходит в миллисекундах
+        return token.access_token, token.expires_at / 1000
+
+    def _set(self, access_token: str, expires_at: float):
+        self.access_token = access_token
+        self.expires_at = expires_at
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"GigaChat token refresh error: {str(e)}")
+            delay = self.expires_at - time.time() - settings.GIGA_TOKEN_REFRESH_MARGIN_SECONDS
+            await asyncio.sleep(max(delay, settings.GIGA_TOKEN_RETRY_SECONDS))
+
+
+_token_managers: Dict[str, GigaChatTokenManager] = {}
+
+
+def get_token_manager(credentials: Optional[str] = None) -> GigaChatTokenManager:
+    """Менеджер токена для учетных данных (по умолчанию GIGA_API_KEY), один на процесс"""
+    credentials = credentials or settings.GIGA_API_KEY
+    manager = _token_managers.get(credentials)
+    if manager is None:
+        manager = GigaChatTokenManager(credentials)
+        _token_managers[credentials] = manager
+    return manager
+
+
+def gigachat_enabled() -> bool:
+    """GigaChat используется по умолчанию и для него заданы учетные данные"""
+    providers = (settings.DEFAULT_PROVIDER, settings.RAG_EMBEDDING_PROVIDER)
+    return bool(settings.GIGA_API_KEY) and "gigachain" in providers
@@ -32,6 +32,12 @@ class YandexGPTProvider(BaseProvider):
             "x-folder-id": settings.YANDEX_FOLDER_ID
         }
         
+        # Текст вложений подставляется в сообщения; в запрос уходят только роль и текст
+        messages = [
+            {"role": msg["role"], "content": self.expand_attachments(msg)[0]}
+            for msg in messages
+        ]
+        
         # Оптимизация контекста
         messages = self.truncate_messages(messages, settings.MAX_CONTEXT_TOKENS)
         
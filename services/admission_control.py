@@ -0,0 +1,96 @@
+import math
+import time
+from contextlib import contextmanager
+from typing import Dict
+from app.utils.config import settings
+from app.utils.logger import logger
+from app.utils.monitoring import REQUESTS_SHED
+
+
+class OverloadedError(Exception):
+    """Провайдер перегружен, запрос отклонен до начала обработки"""
+
+    def __init__(self, provider_name: str, retry_after: int):
+        super().__init__(f"Provider {provider_name} is overloaded, retry after {retry_after}s")
+        self.provider_name = provider_name
+        self.retry_after = retry_after
+
+
+class ProviderLoad:
+    """Нагрузка на провайдера в текущем воркере"""
+
+    def __init__(self):
+        self.in_flight = 0
+        self.latency = 0.0  # Экспоненциальное скользящее среднее, секунды
+
+    def observe(self, duration: float):
+        if self.latency == 0.0:
+            self.latency = duration
+        else:
+            alpha = settings.LOAD_LATENCY_EWMA_ALPHA
+            self.latency = alpha * duration + (1 - alpha) * self.latency
+
+
+class AdmissionController:
+    """
+    Контроль допуска запросов к провайдерам.
+
+    Ожидаемое время ответа оценивается по среднему времени ответа провайдера
+    и числу запросов сверх его пропускной способности. Если оценка не
+    укладывается в LATENCY_SLO_SECONDS, новый запрос отклоняется сразу,
+    а не копится в очереди до таймаута.
+    """
+
+    def __init__(self):
+        self.providers: Dict[str, ProviderLoad] = {}
+
+    def _load(self, provider_name: str) -> ProviderLoad:
+        load = self.providers.get(provider_name)
+        if load is None:
+            load = self.providers[provider_name] = ProviderLoad()
+        return load
+
+    def estimated_latency(self, provider_name: str) -> float:
+        load = self._load(provider_name)
+        capacity = settings.PROVIDER_CAPACITY
+        queued = max(0, load.in_flight + 1 - capacity)
+        return load.latency * (1 + queued / capacity)
+
+    def check(self, provider_name: str):
+        """
+        Проверяет, можно ли принять запрос к провайдеру
+
+        :param provider_name: Имя провайдера
+        :raises OverloadedError: Если SLO по задержке не может быть выполнено
+        """
+        if not settings.LOAD_SHEDDING_ENABLED:
+            return
+
+        load = self._load(provider_name)
+        # Без запросов в работе всегда пропускаем: это обновляет устаревшую оценку
+        if load.in_flight == 0:
+            return
+
+        estimate = self.estimated_latency(provider_name)
+        if estimate > settings.LATENCY_SLO_SECONDS:
+            REQUESTS_SHED.labels(provider=provider_name).inc()
+            logger.warning(
+                f"Shedding request to {provider_name}: in flight {load.in_flight}, "
+                f"estimated latency {estimate:.1f}s"
+            )
+            raise OverloadedError(provider_name, max(1, math.ceil(estimate - settings.LATENCY_SLO_SECONDS)))
+
+    @contextmanager
+    def track(self, provider_name: str):
+        """Учитывает запрос к провайдеру в числе выполняемых и в средней задержке"""
+        load = self._load(provider_name)
+        load.in_flight += 1
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            load.in_flight -= 1
+            load.observe(time.perf_counter() - started)
+
+
+admission_controller = AdmissionController()
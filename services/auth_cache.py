@@ -0,0 +1,136 @@
+import asyncio
+import base64
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from functools import cached_property
+from typing import Optional, Set, Tuple
+from app.services.auth_service import AuthService
+from app.utils.config import settings
+from app.utils.logger import logger
+
+
+class TokenRevokedError(Exception):
+    """Токен отозван"""
+
+
+def _token_hash(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def _token_exp(token: str) -> Optional[float]:
+    """Срок действия из полезной нагрузки JWT (без проверки подписи)"""
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+    except Exception:
+        return None
+
+
+class AuthCache:
+    """
+    Кеш проверенных токенов поверх AuthService.
+
+    Успешная проверка токена кешируется в ограниченном LRU по хешу токена
+    до его exp (но не дольше AUTH_CACHE_MAX_TTL_SECONDS). Отозванные токены
+    хранятся в Redis (sorted set с exp в качестве score); воркеры
+    перечитывают список только при изменении счетчика версий и не чаще
+    AUTH_REVOCATION_SYNC_SECONDS, поэтому обычный запрос не обращается к Redis.
+    Синхронизация выполняется вне цикла событий (sync_revocations) с коротким
+    таймаутом: недоступный Redis не блокирует обработку запросов.
+    """
+
+    revoked_key = "auth:revoked"
+    revoked_version_key = "auth:revoked:version"
+
+    def __init__(self):
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._revoked: Set[str] = set()
+        self._revoked_version: Optional[bytes] = None
+        self._synced_at = 0.0
+
+    @cached_property
+    def auth_service(self) -> AuthService:
+        return AuthService()
+
+    @cached_property
+    def redis(self):
+        from redis import Redis
+        return Redis.from_url(
+            str(settings.REDIS_URL),
+            socket_timeout=settings.AUTH_REDIS_TIMEOUT_SECONDS,
+            socket_connect_timeout=settings.AUTH_REDIS_TIMEOUT_SECONDS
+        )
+
+    async def sync_revocations(self):
+        """Обновляет список отзыва в отдельном потоке, если подошел срок синхронизации"""
+        now = time.monotonic()
+        if now - self._synced_at < settings.AUTH_REVOCATION_SYNC_SECONDS:
+            return
+        # Срок отмечается сразу: параллельные запросы не запускают повторную синхронизацию
+        self._synced_at = now
+        await asyncio.to_thread(self._sync_revocations)
+
+    def get_current_user(self, token: str) -> str:
+        """
+        Идентификатор пользователя по токену; полная проверка только при промахе кеша.
+        Список отзыва обновляется отдельно, через sync_revocations
+
+        :param token: Bearer-токен
+        :raises TokenRevokedError: Если токен отозван
+        """
+        token_hash = _token_hash(token)
+        if token_hash in self._revoked:
+            self._entries.pop(token_hash, None)
+            raise TokenRevokedError("Token has been revoked")
+
+        now = time.time()
+        entry = self._entries.get(token_hash)
+        if entry and entry[1] > now:
+            self._entries.move_to_end(token_hash)
+            return entry[0]
+
+        user_id = self.auth_service.get_current_user(token)
+
+        expires_at = now + settings.AUTH_CACHE_MAX_TTL_SECONDS
+        exp = _token_exp(token)
+        if exp is not None:
+            expires_at = min(expires_at, exp)
+        if expires_at > now:
+            self._entries[token_hash] = (user_id, expires_at)
+            self._entries.move_to_end(token_hash)
+            while len(self._entries) > settings.AUTH_CACHE_SIZE:
+                self._entries.popitem(last=False)
+
+        return user_id
+
+    def revoke(self, token: str):
+        """Отзывает токен во всех воркерах"""
+        token_hash = _token_hash(token)
+        exp = _token_exp(token) or time.time() + settings.AUTH_CACHE_MAX_TTL_SECONDS
+        pipe = self.redis.pipeline()
+        pipe.zadd(self.revoked_key, {token_hash: exp})
+        # Отозванные токены с истекшим сроком больше не нужны
+        pipe.zremrangebyscore(self.revoked_key, "-inf", time.time())
+        pipe.incr(self.revoked_version_key)
+        pipe.execute()
+
+        self._revoked.add(token_hash)
+        self._entries.pop(token_hash, None)
+
+    def _sync_revocations(self):
+        try:
+            version = self.redis.get(self.revoked_version_key)
+            if version == self._revoked_version:
+                return
+            members = self.redis.zrangebyscore(self.revoked_key, time.time(), "+inf")
+            self._revoked = {member.decode() for member in members}
+            self._revoked_version = version
+        except Exception as e:
+            # Оставляем последний известный список отзыва
+            logger.error(f"Revocation list sync error: {str(e)}")
+
+
+auth_cache = AuthCache()
@@ -0,0 +1,171 @@
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+from app.utils.config import settings
+from app.utils.logger import logger
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class FileTooLargeError(Exception):
+    """Загруженный файл превышает MAX_FILE_SIZE_MB"""
+
+
+class FileStorage:
+    """
+    Контентно-адресуемое хранилище загруженных файлов.
+
+    Файл хранится один раз по SHA-256 содержимого:
+        {base}/{sha[:2]}/{sha[2:4]}/{sha}/blob{ext}   - содержимое
+        {base}/{sha[:2]}/{sha[2:4]}/{sha}/refs        - число ссылок из сообщений тредов
+        {base}/{sha[:2]}/{sha[2:4]}/{sha}/derived/    - результаты обработки (текст, анализ)
+    Каталог удаляется, когда число ссылок падает до нуля.
+    Сохраненная загрузка сразу получает ссылку: ее передают сообщению
+    или снимают через release, если файл не понадобился.
+    """
+
+    def __init__(self, base_path: Optional[str] = None):
+        self.base_path = base_path or os.path.join(settings.STORAGE_PATH, "files")
+
+    def _dir(self, sha256: str) -> str:
+        return os.path.join(self.base_path, sha256[:2], sha256[2:4], sha256)
+
+    def blob_path(self, sha256: str, ext: str = "") -> str:
+        return os.path.join(self._dir(sha256), f"blob{ext.lower()}")
+
+    async def save_upload(self, upload) -> Dict[str, Any]:
+        """
+        Сохраняет загруженный файл, вычисляя хеш по ходу чтения, и берет на него ссылку
+
+        :param upload: UploadFile
+        :return: Сведения о файле: sha256, path, filename, size
+        :raises FileTooLargeError: Если файл больше MAX_FILE_SIZE_MB
+        """
+        os.makedirs(self.base_path, exist_ok=True)
+        tmp_path = os.path.join(self.base_path, f".upload-{uuid.uuid4()}")
+        digest = hashlib.sha256()
+        size = 0
+        max_size = settings.MAX_FILE_SIZE_MB * 1024 * 1024
+        try:
+            with open(tmp_path, "wb") as buffer:
+                while True:
+                    chunk = await upload.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > max_size:
+                        raise FileTooLargeError(f"File exceeds {settings.MAX_FILE_SIZE_MB} MB")
+                    digest.update(chunk)
+                    buffer.write(chunk)
+
+            sha256 = digest.hexdigest()
+            path = self.blob_path(sha256, os.path.splitext(upload.filename or "")[1])
+            # Файл и ссылка появляются под той же блокировкой, что и удаление при release
+            with self._locked_refs(sha256) as f:
+                if os.path.exists(path):
+                    os.remove(tmp_path)
+                else:
+                    os.replace(tmp_path, path)
+                self._apply_delta(f, sha256, 1)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        return {"sha256": sha256, "path": path, "filename": upload.filename, "size": size}
+
+    def sha256_of(self, path: str) -> str:
+        """Хеш файла: из пути для файлов хранилища, иначе по содержимому"""
+        directory = os.path.dirname(os.path.abspath(path))
+        if directory.startswith(os.path.abspath(self.base_path) + os.sep):
+            return os.path.basename(directory)
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @contextmanager
+    def _locked_refs(self, sha256: str):
+        """Файл счетчика ссылок под межпроцессной блокировкой"""
+        refs_path = os.path.join(self._dir(sha256), "refs")
+        while True:
+            os.makedirs(self._dir(sha256), exist_ok=True)
+            f = open(refs_path, "a+")
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                # Пока ждали блокировку, каталог мог быть удален при release:
+                # блокировка удаленного файла ничего не защищает, повторяем
+                if os.path.exists(refs_path) and os.stat(refs_path).st_ino == os.fstat(f.fileno()).st_ino:
+                    break
+            except Exception:
+                pass
+            fcntl.flock(f, fcntl.LOCK_UN)
+            f.close()
+        try:
+            yield f
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+            f.close()
+
+    def _apply_delta(self, f, sha256: str, delta: int) -> int:
+        f.seek(0)
+        count = max(0, int(f.read().strip() or 0) + delta)
+        f.seek(0)
+        f.truncate()
+        f.write(str(count))
+        f.flush()
+        if count == 0:
+            shutil.rmtree(self._dir(sha256), ignore_errors=True)
+        return count
+
+    def _update_refs(self, sha256: str, delta: int) -> int:
+        with self._locked_refs(sha256) as f:
+            return self._apply_delta(f, sha256, delta)
+
+    def add_ref(self, sha256: str) -> int:
+        return self._update_refs(sha256, 1)
+
+    def release(self, sha256: str) -> int:
+        """
+        Снимает ссылку на файл; при нуле удаляет файл и результаты его обработки
+
+        :return: Оставшееся число ссылок
+        """
+        if not os.path.isdir(self._dir(sha256)):
+            return 0
+        count = self._update_refs(sha256, -1)
+        if count == 0:
+            logger.info(f"File {sha256} deleted: no references left")
+        return count
+
+    def _derived_path(self, sha256: str, kind: str) -> str:
+        name = hashlib.sha256(kind.encode("utf-8")).hexdigest()[:32]
+        return os.path.join(self._dir(sha256), "derived", f"{name}.json")
+
+    def get_derived(self, sha256: str, kind: str) -> Optional[Any]:
+        """
+        Результат обработки файла, сохраненный ранее
+
+        :param sha256: Хеш файла
+        :param kind: Вид обработки вместе с параметрами (например, process_file:gigachain)
+        """
+        path = self._derived_path(sha256, kind)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)["value"]
+
+    def put_derived(self, sha256: str, kind: str, value: Any):
+        path = self._derived_path(sha256, kind)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"kind": kind, "value": value}, f, ensure_ascii=False, default=str)
+        os.replace(tmp_path, path)
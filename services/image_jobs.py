@@ -0,0 +1,78 @@
+"""
+Фоновый анализ изображений.
+
+Пул обработчиков может работать внутри API-процесса (IMAGE_ANALYSIS_WORKERS > 0)
+или отдельно от него (IMAGE_WORKER_CONCURRENCY обработчиков):
+    python -m app.services.image_jobs
+Загруженные файлы должны быть доступны обработчикам по общему STORAGE_PATH.
+"""
+import asyncio
+from typing import Dict, Optional
+from app.core.chat_manager import ChatManager
+from app.providers.gigachat_token import get_token_manager, gigachat_enabled
+from app.services.job_queue import JobQueue, WorkerPool
+from app.utils.config import settings
+from app.utils.logger import logger
+
+image_analysis_queue = JobQueue("image_analysis")
+
+_chat_manager: Optional[ChatManager] = None
+
+
+class ImageAnalysisError(Exception):
+    """Анализ изображения завершился ошибкой"""
+
+
+async def analyze_image_job(payload: Dict) -> Dict:
+    """Обработчик задачи анализа изображения; по завершении снимает ссылку на файл"""
+    global _chat_manager
+    if _chat_manager is None:
+        _chat_manager = ChatManager()
+
+    try:
+        result = await _chat_manager.analyze_image(
+            payload["image_path"],
+            payload["prompt"],
+            payload["temperature"],
+            payload["max_tokens"]
+        )
+        # VisionPlugin возвращает ошибки результатом - задача должна завершиться как failed
+        if result.get("status") == "error":
+            raise ImageAnalysisError(result.get("message") or "Image analysis failed")
+    except asyncio.CancelledError:
+        # Задача вернется в очередь - файл еще понадобится
+        raise
+    except Exception:
+        _release_image(payload)
+        raise
+    _release_image(payload)
+    return result
+
+
+def _release_image(payload: Dict):
+    if payload.get("sha256"):
+        _chat_manager.file_storage.release(payload["sha256"])
+
+
+def create_worker_pool(concurrency: Optional[int] = None) -> WorkerPool:
+    if concurrency is None:
+        concurrency = settings.IMAGE_ANALYSIS_WORKERS
+    return WorkerPool(image_analysis_queue, analyze_image_job, concurrency)
+
+
+async def run_workers():
+    token_manager = get_token_manager()
+    if gigachat_enabled():
+        token_manager.start()
+    pool = create_worker_pool(settings.IMAGE_ANALYSIS_WORKERS or settings.IMAGE_WORKER_CONCURRENCY)
+    pool.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await pool.stop()
+        await token_manager.stop()
+
+
+if __name__ == "__main__":
+    logger.info("Starting standalone image analysis workers")
+    asyncio.run(run_workers())
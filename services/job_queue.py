@@ -0,0 +1,282 @@
+import asyncio
+import json
+import math
+import uuid
+from datetime import datetime
+from functools import cached_property
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from app.utils.config import settings
+from app.utils.logger import logger
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+FINAL_STATUSES = (JOB_DONE, JOB_FAILED)
+
+
+# Возвращает в очередь задачи, обработчик которых перестал продлевать аренду.
+# Задача без аренды сначала только помечается: воркер мог забрать ее и еще
+# не успеть записать аренду. Возвращается задача, оставшаяся без аренды
+# и при следующем проходе
+_RECLAIM = """
+local requeued = 0
+for _, job_id in ipairs(redis.call("LRANGE", KEYS[1], 0, -1)) do
+    local lease_key = ARGV[1] .. job_id .. ":lease"
+    local orphan_key = ARGV[1] .. job_id .. ":orphan"
+    if redis.call("EXISTS", lease_key) == 0 then
+        if redis.call("EXISTS", orphan_key) == 1 then
+            redis.call("DEL", orphan_key)
+            redis.call("LREM", KEYS[1], 1, job_id)
+            redis.call("RPUSH", KEYS[2], job_id)
+            requeued = requeued + 1
+        else
+            redis.call("SET", orphan_key, 1, "EX", ARGV[2])
+        end
+    end
+end
+return requeued
+"""
+
+
+class QueueFullError(Exception):
+    """Очередь задач переполнена"""
+
+
+class JobQueue:
+    """
+    Очередь фоновых задач на Redis.
+
+    Состояние задачи хранится в ключе job:{id} с TTL, идентификаторы
+    ожидающих задач - в списке jobs:{name}:queue. О завершении задачи
+    сообщается через список job:{id}:done, что позволяет ждать результат
+    через BLPOP без частого опроса.
+
+    Воркер забирает задачу через BLMOVE в список jobs:{name}:processing
+    и продлевает аренду job:{id}:lease, пока выполняет ее. Задача удаляется
+    из списка только при завершении, поэтому задачи упавших воркеров
+    (аренда истекла) возвращаются в очередь через reclaim.
+    """
+
+    def __init__(self, name: str, ttl: Optional[int] = None):
+        self.queue_key = f"jobs:{name}:queue"
+        self.processing_key = f"jobs:{name}:processing"
+        self.ttl = ttl or settings.JOB_TTL_SECONDS
+
+    @cached_property
+    def redis(self):
+        from redis.asyncio import Redis
+        return Redis.from_url(str(settings.REDIS_URL))
+
+    def _job_key(self, job_id: str) -> str:
+        return f"job:{job_id}"
+
+    def _done_key(self, job_id: str) -> str:
+        return f"job:{job_id}:done"
+
+    def _lease_key(self, job_id: str) -> str:
+        return f"job:{job_id}:lease"
+
+    async def submit(self, payload: Dict[str, Any], owner: str) -> str:
+        """
+        Ставит задачу в очередь
+
+        :param payload: Параметры задачи
+        :param owner: Идентификатор пользователя-владельца
+        :return: Идентификатор задачи
+        """
+        if await self.redis.llen(self.queue_key) >= settings.JOB_QUEUE_MAX_LENGTH:
+            raise QueueFullError("Job queue is full")
+
+        job_id = str(uuid.uuid4())
+        job = {
+            "id": job_id,
+            "status": JOB_QUEUED,
+            "owner": owner,
+            "payload": payload,
+            "result": None,
+            "error": None,
+            "created_at": datetime.utcnow(),
+            "updated_at": datetime.utcnow()
+        }
+
+        pipe = self.redis.pipeline()
+        pipe.set(self._job_key(job_id), json.dumps(job, default=str), ex=self.ttl)
+        pipe.lpush(self.queue_key, job_id)
+        await pipe.execute()
+        return job_id
+
+    async def get(self, job_id: str) -> Optional[Dict]:
+        data = await self.redis.get(self._job_key(job_id))
+        return json.loads(data) if data else None
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[Dict]:
+        """
+        Ожидает завершения задачи (long-poll)
+
+        :param job_id: Идентификатор задачи
+        :param timeout: Максимальное время ожидания в секундах
+        :return: Текущее состояние задачи
+        """
+        job = await self.get(job_id)
+        if not job or job["status"] in FINAL_STATUSES or timeout <= 0:
+            return job
+
+        done_key = self._done_key(job_id)
+        notified = await self.redis.blpop(done_key, timeout=math.ceil(timeout))
+        if notified:
+            # Возвращаем отметку, чтобы проснулись и другие ожидающие клиенты
+            pipe = self.redis.pipeline()
+            pipe.rpush(done_key, 1)
+            pipe.expire(done_key, self.ttl)
+            await pipe.execute()
+
+        return await self.get(job_id)
+
+    async def fetch(self, timeout: int = 5) -> Optional[Tuple[str, Dict]]:
+        """
+        Забирает следующую задачу из очереди и помечает ее выполняемой
+
+        :param timeout: Время ожидания задачи в секундах
+        :return: Пара (идентификатор, задача) или None
+        """
+        item = await self.redis.blmove(self.queue_key, self.processing_key, timeout, "RIGHT", "LEFT")
+        if not item:
+            return None
+
+        job_id = item.decode() if isinstance(item, bytes) else item
+        await self.extend_lease(job_id)
+        job = await self.get(job_id)
+        if not job:
+            # Задача истекла по TTL, пока стояла в очереди
+            await self._finish(job_id)
+            return None
+
+        await self._save(job, status=JOB_RUNNING)
+        return job_id, job
+
+    async def extend_lease(self, job_id: str):
+        """Продлевает аренду выполняемой задачи"""
+        await self.redis.set(self._lease_key(job_id), 1, ex=settings.JOB_LEASE_SECONDS)
+
+    async def requeue(self, job: Dict):
+        """Возвращает незавершенную задачу в начало очереди (остановка воркера)"""
+        await self._save(job, status=JOB_QUEUED)
+        pipe = self.redis.pipeline()
+        pipe.lrem(self.processing_key, 1, job["id"])
+        pipe.rpush(self.queue_key, job["id"])
+        pipe.delete(self._lease_key(job["id"]))
+        await pipe.execute()
+
+    async def reclaim(self) -> int:
+        """
+        Возвращает в очередь задачи упавших воркеров
+
+        :return: Количество возвращенных задач
+        """
+        return await self.redis.eval(
+            _RECLAIM, 2, self.processing_key, self.queue_key,
+            "job:", settings.JOB_LEASE_SECONDS * 3
+        )
+
+    async def complete(self, job: Dict, result: Any):
+        await self._save(job, status=JOB_DONE, result=result)
+        await self._finish(job["id"])
+        await self._notify(job["id"])
+
+    async def fail(self, job: Dict, error: str):
+        await self._save(job, status=JOB_FAILED, error=error)
+        await self._finish(job["id"])
+        await self._notify(job["id"])
+
+    async def _finish(self, job_id: str):
+        pipe = self.redis.pipeline()
+        pipe.lrem(self.processing_key, 1, job_id)
+        pipe.delete(self._lease_key(job_id))
+        await pipe.execute()
+
+    async def _save(self, job: Dict, **update):
+        job.update(update)
+        job["updated_at"] = datetime.utcnow()
+        await self.redis.set(self._job_key(job["id"]), json.dumps(job, default=str), ex=self.ttl)
+
+    async def _notify(self, job_id: str):
+        done_key = self._done_key(job_id)
+        pipe = self.redis.pipeline()
+        pipe.rpush(done_key, 1)
+        pipe.expire(done_key, self.ttl)
+        await pipe.execute()
+
+
+class WorkerPool:
+    """Ограниченный пул асинхронных обработчиков очереди задач"""
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        handler: Callable[[Dict], Awaitable[Any]],
+        concurrency: int
+    ):
+        self.queue = queue
+        self.handler = handler
+        self.concurrency = concurrency
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self):
+        for worker_id in range(self.concurrency):
+            self._tasks.append(asyncio.create_task(self._run(worker_id)))
+        self._tasks.append(asyncio.create_task(self._reclaim()))
+        logger.info(f"Worker pool for {self.queue.queue_key} started: {self.concurrency} workers")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _run(self, worker_id: int):
+        while True:
+            try:
+                item = await self.queue.fetch()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Worker {worker_id} queue error: {str(e)}")
+                await asyncio.sleep(1)
+                continue
+
+            if item is None:
+                continue
+
+            job_id, job = item
+            heartbeat = asyncio.create_task(self._heartbeat(job_id))
+            try:
+                result = await self.handler(job["payload"])
+                await self.queue.complete(job, result)
+            except asyncio.CancelledError:
+                # Остановка пула: задачу выполнит другой воркер
+                await self.queue.requeue(job)
+                raise
+            except Exception as e:
+                logger.error(f"Job {job_id} failed: {str(e)}")
+                await self.queue.fail(job, str(e))
+            finally:
+                heartbeat.cancel()
+
+    async def _heartbeat(self, job_id: str):
+        while True:
+            await asyncio.sleep(settings.JOB_LEASE_SECONDS / 3)
+            try:
+                await self.queue.extend_lease(job_id)
+            except Exception as e:
+                logger.error(f"Job {job_id} lease error: {str(e)}")
+
+    async def _reclaim(self):
+        while True:
+            try:
+                requeued = await self.queue.reclaim()
+                if requeued:
+                    logger.info(f"Requeued {requeued} stale jobs from {self.queue.processing_key}")
+            except Exception as e:
+                logger.error(f"Job reclaim error: {str(e)}")
+            await asyncio.sleep(settings.JOB_LEASE_SECONDS)
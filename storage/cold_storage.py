@@ -0,0 +1,78 @@
+import glob
+import gzip
+import json
+import os
+from typing import Dict, Optional
+from app.utils.config import settings
+
+
+class FileColdStorage:
+    """
+    Холодное хранение тредов в сжатых gzip JSON-файлах.
+    Копия хранится под версией треда, чтобы удалялась именно прочитанная копия,
+    а не более новая, записанная повторным переносом.
+    """
+
+    def __init__(self, base_path: Optional[str] = None):
+        self.base_path = base_path or os.path.join(settings.STORAGE_PATH, "cold_threads")
+
+    def _path(self, thread_id: str, version: Optional[int] = None) -> str:
+        # Без версии - копии, записанные до появления версий в имени
+        name = f"{thread_id}.json.gz" if version is None else f"{thread_id}.v{version}.json.gz"
+        return os.path.join(self.base_path, thread_id[:2], name)
+
+    def save(self, thread: Dict):
+        path = self._path(thread["id"], thread.get("version", 0))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump(thread, f, ensure_ascii=False, default=str)
+        os.replace(tmp_path, path)
+
+    def load(self, thread_id: str, version: Optional[int] = None) -> Optional[Dict]:
+        for path in (self._path(thread_id, version), self._path(thread_id)):
+            if os.path.exists(path):
+                with gzip.open(path, "rt", encoding="utf-8") as f:
+                    return json.load(f)
+        return None
+
+    def delete(self, thread_id: str, version: Optional[int] = None):
+        """
+        :param version: Удалить только копию этой версии; без версии удаляются все копии
+        """
+        if version is not None:
+            paths = [self._path(thread_id, version)]
+        else:
+            paths = [self._path(thread_id)] + glob.glob(self._path(thread_id, "*"))
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class SQLColdStorage:
+    """Холодное хранение тредов в SQL-бэкенде ThreadStorage"""
+
+    def __init__(self, database_url: str):
+        from app.storage.thread_storage import ThreadStorage
+        self.storage = ThreadStorage(database_url)
+
+    def save(self, thread: Dict):
+        self.storage.bulk_upsert([thread])
+
+    def load(self, thread_id: str, version: Optional[int] = None) -> Optional[Dict]:
+        return self.storage.get_thread(thread_id)
+
+    def delete(self, thread_id: str, version: Optional[int] = None):
+        """
+        :param version: Удалить копию, только если она этой версии
+        """
+        self.storage.delete_thread(thread_id, version)
+
+
+def create_cold_storage(target: str):
+    """
+    :param target: "file" или URL SQLAlchemy
+    """
+    if target == "file":
+        return FileColdStorage()
+    return SQLColdStorage(target)
@@ -0,0 +1,225 @@
+import re
+import time
+import uuid
+from typing import Callable, Dict, List
+from app.utils.config import settings
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(value: str) -> List[str]:
+    """Уникальные термы текста в нижнем регистре, в порядке появления"""
+    return list(dict.fromkeys(
+        token for token in _TOKEN_RE.findall((value or "").lower()) if len(token) > 1
+    ))
+
+
+class SearchUnavailableError(Exception):
+    """Полнотекстовый поиск не поддерживается бэкендом хранилища"""
+
+
+def _phrase(value: str) -> str:
+    """Строка как фраза FTS5"""
+    return '"' + value.replace('"', '""') + '"'
+
+
+def _empty_page(limit: int, offset: int) -> Dict:
+    return {"total": 0, "limit": limit, "offset": offset, "results": []}
+
+
+class SQLiteSearchIndex:
+    """
+    Полнотекстовый индекс сообщений на SQLite FTS5.
+
+    Строка индекса соответствует одному сообщению. user_id и thread_id
+    индексируются, чтобы поиск и удаление выполнялись через MATCH, без
+    полного просмотра таблицы. Записи добавляются в той же транзакции,
+    что и сообщения треда.
+    """
+
+    table = "message_search"
+
+    def __init__(self, engine):
+        from sqlalchemy import text
+        with engine.begin() as connection:
+            connection.execute(text(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} USING fts5("
+                "content, user_id, thread_id, message_index UNINDEXED, role UNINDEXED, "
+                "tokenize = 'unicode61 remove_diacritics 2')"
+            ))
+
+    def add(self, session, thread: Dict, start: int = 0):
+        """
+        Индексирует сообщения треда, начиная с позиции start
+
+        :param session: Сессия (соединение) транзакции записи треда
+        """
+        from sqlalchemy import text
+        rows = [{
+            "content": message.get("content") or "",
+            "user_id": thread["user_id"],
+            "thread_id": thread["id"],
+            "message_index": index,
+            "role": message.get("role")
+        } for index, message in enumerate(thread["messages"][start:], start) if message.get("content")]
+        if rows:
+            session.execute(text(
+                f"INSERT INTO {self.table} (content, user_id, thread_id, message_index, role) "
+                "VALUES (:content, :user_id, :thread_id, :message_index, :role)"
+            ), rows)
+
+    def remove(self, session, thread_id: str):
+        from sqlalchemy import text
+        session.execute(text(
+            f"DELETE FROM {self.table} WHERE rowid IN ("
+            f"SELECT rowid FROM {self.table} WHERE {self.table} MATCH :match AND thread_id = :thread_id)"
+        ), {"match": f"thread_id : {_phrase(thread_id)}", "thread_id": thread_id})
+
+    def search(self, session, user_id: str, query: str, limit: int, offset: int) -> Dict:
+        """Сообщения пользователя со всеми термами запроса, по релевантности (bm25)"""
+        from sqlalchemy import text
+        terms = tokenize(query)
+        if not terms:
+            return _empty_page(limit, offset)
+
+        match = " AND ".join(
+            [f"user_id : {_phrase(user_id)}"] + [f"content : {_phrase(term)}" for term in terms]
+        )
+        params = {"match": match, "user_id": user_id, "limit": limit, "offset": offset}
+        where = f"{self.table} MATCH :match AND user_id = :user_id"
+
+        total = session.execute(text(f"SELECT count(*) FROM {self.table} WHERE {where}"), params).scalar()
+        rows = session.execute(text(
+            f"SELECT thread_id, message_index, role, "
+            f"snippet({self.table}, 0, '**', '**', '…', :tokens) AS snippet "
+            f"FROM {self.table} WHERE {where} ORDER BY rank LIMIT :limit OFFSET :offset"
+        ), {**params, "tokens": max(1, settings.SEARCH_SNIPPET_CHARS // 8)}).mappings().all()
+
+        return {
+            "total": total,
+            "limit": limit,
+            "offset": offset,
+            "results": [{
+                "thread_id": row["thread_id"],
+                "message_index": int(row["message_index"]),
+                "role": row["role"],
+                "snippet": row["snippet"]
+            } for row in rows]
+        }
+
+
+class RedisSearchIndex:
+    """
+    Инвертированный индекс сообщений в Redis (без RediSearch).
+
+    search:{user_id}:{term}  - sorted set "{thread_id}:{index}" с временем записи
+    search_terms:{thread_id} - set термов треда (для удаления)
+    search_size:{thread_id}  - число проиндексированных сообщений (для удаления)
+    Списки ведутся по пользователю, поэтому поиск затрагивает только его историю.
+    Текст сообщений в индексе не копируется: сниппеты строятся при запросе
+    по тредам найденных сообщений страницы.
+    """
+
+    def __init__(self, redis):
+        self.redis = redis
+
+    @staticmethod
+    def _term_key(user_id: str, term: str) -> str:
+        return f"search:{user_id}:{term}"
+
+    def add(self, pipe, thread: Dict, start: int = 0):
+        """
+        Индексирует сообщения треда, начиная с позиции start
+
+        :param pipe: Pipeline (транзакция) записи треда
+        """
+        now = time.time()
+        thread_terms = set()
+        for index, message in enumerate(thread["messages"][start:], start):
+            terms = tokenize(message.get("content"))
+            if not terms:
+                continue
+            member = f"{thread['id']}:{index}"
+            for term in terms:
+                pipe.zadd(self._term_key(thread["user_id"], term), {member: now})
+            thread_terms.update(terms)
+        if thread_terms:
+            pipe.sadd(f"search_terms:{thread['id']}", *thread_terms)
+            pipe.set(f"search_size:{thread['id']}", len(thread["messages"]))
+
+    def remove(self, thread_id: str, user_id: str):
+        terms = self.redis.smembers(f"search_terms:{thread_id}")
+        size = int(self.redis.get(f"search_size:{thread_id}") or 0)
+        # Индекс, записанный до появления search_size, хранил позиции в search_docs
+        indexes = range(size) if size else [index.decode() for index in self.redis.hkeys(f"search_docs:{thread_id}")]
+        members = [f"{thread_id}:{index}" for index in indexes]
+        pipe = self.redis.pipeline(transaction=False)
+        if members:
+            for term in terms:
+                pipe.zrem(self._term_key(user_id, term.decode()), *members)
+        pipe.delete(f"search_docs:{thread_id}", f"search_terms:{thread_id}", f"search_size:{thread_id}")
+        pipe.execute()
+
+    def search(
+        self,
+        user_id: str,
+        query: str,
+        limit: int,
+        offset: int,
+        load_threads: Callable[[List[str]], Dict[str, Dict]]
+    ) -> Dict:
+        """
+        Сообщения пользователя со всеми термами запроса, от новых к старым
+
+        :param load_threads: Чтение тредов по идентификаторам (для сниппетов найденных сообщений)
+        """
+        terms = tokenize(query)
+        if not terms:
+            return _empty_page(limit, offset)
+
+        keys = [self._term_key(user_id, term) for term in terms]
+        pipe = self.redis.pipeline()
+        if len(keys) == 1:
+            key = keys[0]
+        else:
+            # Пересечение во временном ключе, удаляется в той же транзакции
+            key = f"search:tmp:{uuid.uuid4()}"
+            pipe.zinterstore(key, keys, aggregate="MAX")
+        pipe.zcard(key)
+        pipe.zrevrange(key, offset, offset + limit - 1)
+        if len(keys) > 1:
+            pipe.delete(key)
+        results = pipe.execute()
+        if len(keys) > 1:
+            results = results[1:]
+        total, members = results[0], results[1]
+
+        hits = [(thread_id, int(index)) for thread_id, index in
+                (member.decode().rsplit(":", 1) for member in members)]
+        threads = load_threads(list({thread_id for thread_id, _ in hits})) if hits else {}
+
+        page = []
+        for thread_id, index in hits:
+            messages = (threads.get(thread_id) or {}).get("messages") or []
+            # Тред удален между чтением индекса и треда
+            if index >= len(messages):
+                continue
+            message = messages[index]
+            page.append({
+                "thread_id": thread_id,
+                "message_index": index,
+                "role": message.get("role"),
+                "snippet": make_snippet(message.get("content") or "", terms)
+            })
+        return {"total": total, "limit": limit, "offset": offset, "results": page}
+
+
+def make_snippet(content: str, terms: List[str]) -> str:
+    """Фрагмент текста вокруг первого совпадения с выделением термов"""
+    width = settings.SEARCH_SNIPPET_CHARS
+    pattern = re.compile(r"\b(" + "|".join(map(re.escape, terms)) + r")\b", re.IGNORECASE)
+    match = pattern.search(content)
+    begin = max(0, (match.start() if match else 0) - width // 3)
+    end = min(len(content), begin + width)
+    snippet = pattern.sub(r"**\1**", content[begin:end])
+    return ("…" if begin > 0 else "") + snippet + ("…" if end < len(content) else "")
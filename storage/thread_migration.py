@@ -0,0 +1,153 @@
+"""
+Потоковый экспорт/импорт тредов в NDJSON и перенос между Redis и SQL.
+
+Примеры:
+    python -m app.storage.thread_migration export --source redis://localhost:6379/0 --output threads.ndjson
+    python -m app.storage.thread_migration import --target sqlite:///storage/database.db --input threads.ndjson
+    python -m app.storage.thread_migration migrate --source redis://localhost:6379/0 --target sqlite:///storage/database.db
+    python -m app.storage.thread_migration reindex --source redis://localhost:6379/0
+
+Все команды работают пачками с постоянным расходом памяти. С --checkpoint
+позиция сохраняется после каждой пачки, и прерванная команда продолжается
+с нее при повторном запуске с теми же аргументами.
+"""
+import argparse
+import json
+import os
+from typing import Dict, Optional
+from app.storage.thread_storage import ThreadStorage
+from app.utils.logger import logger
+
+
+def _load_checkpoint(path: Optional[str]) -> Dict:
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_checkpoint(path: Optional[str], checkpoint: Dict):
+    if not path:
+        return
+    # Атомарная замена, чтобы сбой не оставил поврежденный файл
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+
+def export_threads(source: ThreadStorage, output_path: str, batch_size: int, checkpoint_path: Optional[str] = None) -> int:
+    """
+    Выгружает треды в NDJSON (один тред на строку)
+
+    :return: Общее количество выгруженных тредов
+    """
+    checkpoint = _load_checkpoint(checkpoint_path)
+    if checkpoint.get("done"):
+        return checkpoint["count"]
+
+    count = checkpoint.get("count", 0)
+    resuming = bool(checkpoint)
+    with open(output_path, "a" if resuming else "w", encoding="utf-8") as f:
+        if resuming:
+            # Отбрасываем строки, записанные после последней контрольной точки
+            f.truncate(checkpoint["offset"])
+        for cursor, threads in source.iter_threads(batch_size, checkpoint.get("cursor")):
+            for thread in threads:
+                f.write(json.dumps(thread, ensure_ascii=False, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+            count += len(threads)
+            _save_checkpoint(checkpoint_path, {
+                "cursor": cursor,
+                "offset": f.tell(),
+                "count": count,
+                "done": cursor is None
+            })
+            logger.info(f"Exported {count} threads")
+    return count
+
+
+def import_threads(target: ThreadStorage, input_path: str, batch_size: int, checkpoint_path: Optional[str] = None) -> int:
+    """
+    Загружает треды из NDJSON пачками
+
+    :return: Общее количество загруженных тредов
+    """
+    checkpoint = _load_checkpoint(checkpoint_path)
+    count = checkpoint.get("count", 0)
+    batch = []
+    with open(input_path, "r", encoding="utf-8") as f:
+        f.seek(checkpoint.get("offset", 0))
+        while True:
+            line = f.readline()
+            if line.strip():
+                batch.append(json.loads(line))
+            if len(batch) >= batch_size or (not line and batch):
+                target.bulk_upsert(batch)
+                count += len(batch)
+                batch = []
+                _save_checkpoint(checkpoint_path, {"offset": f.tell(), "count": count})
+                logger.info(f"Imported {count} threads")
+            if not line:
+                break
+    return count
+
+
+def migrate_threads(source: ThreadStorage, target: ThreadStorage, batch_size: int, checkpoint_path: Optional[str] = None) -> int:
+    """
+    Переносит треды из одного хранилища в другое без промежуточного файла
+
+    :return: Общее количество перенесенных тредов
+    """
+    checkpoint = _load_checkpoint(checkpoint_path)
+    if checkpoint.get("done"):
+        return checkpoint["count"]
+
+    count = checkpoint.get("count", 0)
+    for cursor, threads in source.iter_threads(batch_size, checkpoint.get("cursor")):
+        target.bulk_upsert(threads)
+        count += len(threads)
+        _save_checkpoint(checkpoint_path, {"cursor": cursor, "count": count, "done": cursor is None})
+        logger.info(f"Migrated {count} threads")
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Экспорт, импорт и перенос тредов DataRex")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Выгрузка тредов в NDJSON")
+    export_parser.add_argument("--source", help="URL хранилища (по умолчанию DATABASE_URL)")
+    export_parser.add_argument("--output", required=True, help="Файл NDJSON")
+
+    import_parser = subparsers.add_parser("import", help="Загрузка тредов из NDJSON")
+    import_parser.add_argument("--target", help="URL хранилища (по умолчанию DATABASE_URL)")
+    import_parser.add_argument("--input", required=True, help="Файл NDJSON")
+
+    migrate_parser = subparsers.add_parser("migrate", help="Перенос тредов между хранилищами")
+    migrate_parser.add_argument("--source", required=True, help="URL исходного хранилища")
+    migrate_parser.add_argument("--target", required=True, help="URL целевого хранилища")
+
+    reindex_parser = subparsers.add_parser("reindex", help="Перестроение поискового индекса сообщений")
+    reindex_parser.add_argument("--source", help="URL хранилища (по умолчанию DATABASE_URL)")
+    reindex_parser.add_argument("--batch-size", type=int, default=500, help="Размер пачки")
+
+    for subparser in (export_parser, import_parser, migrate_parser):
+        subparser.add_argument("--batch-size", type=int, default=500, help="Размер пачки")
+        subparser.add_argument("--checkpoint", help="Файл контрольной точки для продолжения")
+
+    args = parser.parse_args()
+    if args.command == "export":
+        count = export_threads(ThreadStorage(args.source), args.output, args.batch_size, args.checkpoint)
+    elif args.command == "import":
+        count = import_threads(ThreadStorage(args.target), args.input, args.batch_size, args.checkpoint)
+    elif args.command == "reindex":
+        count = ThreadStorage(args.source).rebuild_search_index(args.batch_size)
+    else:
+        count = migrate_threads(ThreadStorage(args.source), ThreadStorage(args.target), args.batch_size, args.checkpoint)
+    logger.info(f"{args.command} finished: {count} threads")
+
+
+if __name__ == "__main__":
+    main()
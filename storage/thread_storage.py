@@ -1,12 +1,18 @@
 import os
 import json
+import random
+import time
 import uuid
 from datetime import datetime
-from typing import Dict, List, Optional
+from functools import cached_property
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from app.storage.search_index import RedisSearchIndex, SQLiteSearchIndex, SearchUnavailableError
 from app.utils.config import settings
 from app.utils.logger import logger
+from app.utils.tracing import traced
 from redis import Redis
-from sqlalchemy import create_engine, Column, String, JSON, DateTime
+from redis.exceptions import WatchError
+from sqlalchemy import create_engine, inspect, text, Column, String, JSON, DateTime, Integer
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -22,18 +28,52 @@ class ThreadModel(Base):
     updated_at = Column(DateTime)
     messages = Column(JSON)
     provider = Column(String)
+    version = Column(Integer, nullable=False, default=0)
+
+def _parse_datetime(value) -> Optional[datetime]:
+    """Дата из JSON-представления треда (в Redis даты хранятся строками)"""
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(str(value))
+
+_HSET_IF_MISSING = """
+if redis.call('exists', KEYS[1]) == 1 then return 0 end
+redis.call('hset', KEYS[1], unpack(ARGV))
+return 1
+"""
+
+class ConcurrentUpdateError(Exception):
+    """Тред не удалось записать из-за конкурентных изменений"""
 
 class ThreadStorage:
-    def __init__(self):
-        if settings.DATABASE_URL.startswith("redis"):
-            self.redis = Redis.from_url(settings.REDIS_URL)
+    def __init__(self, database_url: Optional[str] = None):
+        """
+        :param database_url: URL хранилища; по умолчанию DATABASE_URL из настроек
+        """
+        url = database_url or settings.DATABASE_URL
+        if url.startswith("redis"):
+            self.redis = Redis.from_url(database_url or settings.REDIS_URL)
             self.mode = "redis"
+            self.search_index = RedisSearchIndex(self.redis)
         else:
-            self.engine = create_engine(settings.DATABASE_URL)
+            self.engine = create_engine(url)
             Base.metadata.create_all(self.engine)
+            self._migrate_schema()
             self.Session = sessionmaker(bind=self.engine)
             self.mode = "database"
+            # FTS5 есть только в SQLite; для других СУБД поиск недоступен
+            self.search_index = SQLiteSearchIndex(self.engine) if self.engine.dialect.name == "sqlite" else None
 
+    def _migrate_schema(self):
+        """Добавляет столбцы, появившиеся после создания таблицы"""
+        columns = {column["name"] for column in inspect(self.engine).get_columns("threads")}
+        if "version" not in columns:
+            with self.engine.begin() as connection:
+                connection.execute(text(
+                    "ALTER TABLE threads ADD COLUMN version INTEGER NOT NULL DEFAULT 0"
+                ))
+
+    @traced("storage.create_thread")
     def create_thread(self, user_id: str, title: str = "New Conversation", provider: str = None) -> str:
         thread_id = str(uuid.uuid4())
         thread_data = {
@@ -43,11 +83,14 @@ class ThreadStorage:
             "created_at": datetime.utcnow(),
             "updated_at": datetime.utcnow(),
             "messages": [],
-            "provider": provider or settings.DEFAULT_PROVIDER
+            "provider": provider or settings.DEFAULT_PROVIDER,
+            "version": 0
         }
         
         if self.mode == "redis":
-            self.redis.set(f"thread:{thread_id}", json.dumps(thread_data, default=str))
+            pipe = self.redis.pipeline()
+            self._redis_write(pipe, thread_data)
+            pipe.execute()
         else:
             session = self.Session()
             thread = ThreadModel(**thread_data)
@@ -57,48 +100,579 @@ class ThreadStorage:
         
         return thread_id
 
+    @traced("storage.get_thread")
     def get_thread(self, thread_id: str) -> Dict:
         if self.mode == "redis":
             data = self.redis.get(f"thread:{thread_id}")
-            return json.loads(data) if data else None
+            return self._hydrate(json.loads(data)) if data else None
         else:
             session = self.Session()
             thread = session.query(ThreadModel).filter_by(id=thread_id).first()
             session.close()
-            return {
-                "id": thread.id,
-                "user_id": thread.user_id,
-                "title": thread.title,
-                "created_at": thread.created_at,
-                "updated_at": thread.updated_at,
-                "messages": thread.messages,
-                "provider": thread.provider
-            } if thread else None
-
-    def update_thread(self, thread_id: str, update_data: Dict):
-        thread = self.get_thread(thread_id)
-        if not thread:
-            raise ValueError("Thread not found")
+            return self._model_to_dict(thread) if thread else None
+
+    @traced("storage.get_thread_meta")
+    def get_thread_meta(self, thread_id: str) -> Optional[Dict]:
+        """
+        Владелец, версия и время изменения треда без загрузки сообщений
         
-        thread.update(update_data)
-        thread["updated_at"] = datetime.utcnow()
+        :param thread_id: Идентификатор треда
+        :return: Словарь user_id, version, updated_at или None
+        """
+        if self.mode == "redis":
+            meta = self.redis.hgetall(f"thread_meta:{thread_id}")
+            if meta:
+                return {key.decode(): value.decode() for key, value in meta.items()}
+            # Треды, записанные до появления метаданных
+            thread = self.get_thread(thread_id)
+        else:
+            session = self.Session()
+            thread = session.query(
+                ThreadModel.user_id, ThreadModel.version, ThreadModel.updated_at
+            ).filter_by(id=thread_id).first()
+            session.close()
+            thread = thread._asdict() if thread else None
         
+        if not thread:
+            return None
+        return {
+            "user_id": thread["user_id"],
+            "version": str(thread.get("version", 0)),
+            "updated_at": str(thread["updated_at"])
+        }
+
+    @traced("storage.delete_thread")
+    def delete_thread(self, thread_id: str, version: Optional[int] = None) -> bool:
+        """
+        :param version: Только для БД: удалить, только если тред этой версии
+        """
         if self.mode == "redis":
-            self.redis.set(f"thread:{thread_id}", json.dumps(thread, default=str))
+            if settings.THREAD_COLD_STORAGE:
+                self.cold_storage.delete(thread_id)
+            user_id = self.redis.hget(f"thread_meta:{thread_id}", "user_id")
+            if user_id:
+                user_id = user_id.decode()
+            else:
+                # Треды, записанные до появления метаданных
+                data = self.redis.get(f"thread:{thread_id}")
+                user_id = json.loads(data)["user_id"] if data else None
+            if user_id:
+                self.search_index.remove(thread_id, user_id)
+            return self.redis.delete(f"thread:{thread_id}", f"thread_meta:{thread_id}") > 0
         else:
             session = self.Session()
-            session.query(ThreadModel).filter_by(id=thread_id).update(update_data)
+            query = session.query(ThreadModel).filter_by(id=thread_id)
+            if version is not None:
+                query = query.filter_by(version=version)
+            deleted = query.delete()
+            if self.search_index and deleted:
+                self.search_index.remove(session, thread_id)
             session.commit()
             session.close()
+            return deleted > 0
 
-    def add_message(self, thread_id: str, message: Dict):
-        thread = self.get_thread(thread_id)
-        if not thread:
-            raise ValueError("Thread not found")
+    @traced("storage.get_threads")
+    def get_threads(self, thread_ids: List[str]) -> Dict[str, Dict]:
+        """Загружает несколько тредов за один запрос к хранилищу"""
+        if not thread_ids:
+            return {}
+        
+        if self.mode == "redis":
+            values = self.redis.mget([f"thread:{thread_id}" for thread_id in thread_ids])
+            return {
+                thread_id: self._hydrate(json.loads(data))
+                for thread_id, data in zip(thread_ids, values) if data
+            }
+        else:
+            session = self.Session()
+            threads = session.query(ThreadModel).filter(ThreadModel.id.in_(thread_ids)).all()
+            session.close()
+            return {t.id: self._model_to_dict(t) for t in threads}
+
+    @traced("storage.update_thread")
+    def update_thread(self, thread_id: str, update_data: Dict) -> Dict:
+        return self._modify_thread(thread_id, lambda thread: thread.update(update_data))
+
+    @traced("storage.add_message")
+    def add_message(self, thread_id: str, message: Dict) -> Dict:
+        return self._modify_thread(thread_id, lambda thread: thread["messages"].append(message))
+
+    def _modify_thread(self, thread_id: str, mutate: Callable[[Dict], None]) -> Dict:
+        """
+        Read-modify-write треда с оптимистичной блокировкой по версии.
+        Redis: WATCH/MULTI, БД: UPDATE ... WHERE version = ?.
+        При конфликте изменение повторяется на свежих данных.
+        
+        :param thread_id: Идентификатор треда
+        :param mutate: Функция, изменяющая словарь треда на месте
+        :return: Записанный тред
+        """
+        for attempt in range(settings.THREAD_WRITE_RETRIES):
+            if self.mode == "redis":
+                key = f"thread:{thread_id}"
+                with self.redis.pipeline() as pipe:
+                    try:
+                        pipe.watch(key)
+                        data = pipe.get(key)
+                        if not data:
+                            raise ValueError("Thread not found")
+                        thread = json.loads(data)
+                        if thread.get("cold"):
+                            pipe.unwatch()
+                            self._rehydrate(thread_id)
+                            continue
+                        start = len(thread["messages"])
+                        mutate(thread)
+                        thread["version"] = thread.get("version", 0) + 1
+                        thread["updated_at"] = datetime.utcnow()
+                        pipe.multi()
+                        self._redis_write(pipe, thread)
+                        self._index_messages(pipe, thread, start)
+                        pipe.execute()
+                        return thread
+                    except WatchError:
+                        pass
+            else:
+                session = self.Session()
+                try:
+                    row = session.query(ThreadModel).filter_by(id=thread_id).first()
+                    if not row:
+                        raise ValueError("Thread not found")
+                    thread = self._model_to_dict(row)
+                    thread["messages"] = list(thread["messages"] or [])
+                    version = row.version
+                    start = len(thread["messages"])
+                    mutate(thread)
+                    thread["version"] = version + 1
+                    thread["updated_at"] = datetime.utcnow()
+                    updated = session.query(ThreadModel).filter_by(
+                        id=thread_id, version=version
+                    ).update(self._row_values(thread), synchronize_session=False)
+                    if updated:
+                        self._index_messages(session, thread, start)
+                    session.commit()
+                    if updated:
+                        return thread
+                finally:
+                    session.close()
+            
+            self._backoff(attempt)
+        
+        raise ConcurrentUpdateError(f"Thread {thread_id} is being modified concurrently")
+
+    @traced("storage.add_messages")
+    def add_messages(self, messages: List[Tuple[str, Dict]]):
+        """
+        Групповое добавление сообщений в несколько тредов:
+        одна транзакция MULTI в Redis или одна транзакция в БД,
+        с той же оптимистичной блокировкой, что и add_message.
+        Сообщения с id, уже записанным в тред, пропускаются (повтор журнала)
+        
+        :param messages: Пары (идентификатор треда, сообщение) в порядке добавления
+        """
+        grouped: Dict[str, List[Dict]] = {}
+        for thread_id, message in messages:
+            grouped.setdefault(thread_id, []).append(message)
+        if not grouped:
+            return
+        
+        thread_ids = list(grouped)
+        for attempt in range(settings.THREAD_WRITE_RETRIES):
+            now = datetime.utcnow()
+            if self.mode == "redis":
+                keys = [f"thread:{thread_id}" for thread_id in thread_ids]
+                with self.redis.pipeline() as pipe:
+                    try:
+                        pipe.watch(*keys)
+                        threads = [json.loads(data) if data else None for data in pipe.mget(keys)]
+                        cold = [thread["id"] for thread in threads if thread and thread.get("cold")]
+                        if cold:
+                            pipe.unwatch()
+                            for thread_id in cold:
+                                self._rehydrate(thread_id)
+                            continue
+                        found = set()
+                        pipe.multi()
+                        for thread_id, thread in zip(thread_ids, threads):
+                            if not thread:
+                                continue
+                            start = len(thread["messages"])
+                            thread["messages"].extend(self._new_messages(thread["messages"], grouped[thread_id]))
+                            thread["version"] = thread.get("version", 0) + 1
+                            thread["updated_at"] = now
+                            self._redis_write(pipe, thread)
+                            self._index_messages(pipe, thread, start)
+                            found.add(thread_id)
+                        pipe.execute()
+                        break
+                    except WatchError:
+                        pass
+            else:
+                session = self.Session()
+                try:
+                    rows = session.query(ThreadModel).filter(ThreadModel.id.in_(thread_ids)).all()
+                    found = set()
+                    conflict = False
+                    for row in rows:
+                        messages = (row.messages or []) + self._new_messages(row.messages or [], grouped[row.id])
+                        updated = session.query(ThreadModel).filter_by(
+                            id=row.id, version=row.version
+                        ).update({
+                            "messages": messages,
+                            "version": row.version + 1,
+                            "updated_at": now
+                        }, synchronize_session=False)
+                        if not updated:
+                            conflict = True
+                            break
+                        self._index_messages(
+                            session,
+                            {"id": row.id, "user_id": row.user_id, "messages": messages},
+                            len(row.messages or [])
+                        )
+                        found.add(row.id)
+                    if conflict:
+                        session.rollback()
+                    else:
+                        session.commit()
+                        break
+                except Exception:
+                    session.rollback()
+                    raise
+                finally:
+                    session.close()
+            
+            self._backoff(attempt)
+        else:
+            raise ConcurrentUpdateError("Threads are being modified concurrently")
+        
+        missing = set(grouped) - found
+        if missing:
+            logger.error(f"Threads not found while adding messages: {', '.join(missing)}")
+
+    @staticmethod
+    def _new_messages(existing: List[Dict], messages: List[Dict]) -> List[Dict]:
+        """Сообщения, которых еще нет в треде (по id)"""
+        written = {message.get("id") for message in existing if message.get("id")}
+        return [message for message in messages if not message.get("id") or message["id"] not in written]
+
+    @staticmethod
+    def _meta_fields(thread: Dict) -> Dict:
+        return {
+            "user_id": thread["user_id"],
+            "version": thread.get("version", 0),
+            "updated_at": str(thread["updated_at"]),
+            "cold": int(bool(thread.get("cold")))
+        }
+
+    @classmethod
+    def _redis_write(cls, pipe, thread: Dict):
+        """Запись треда и его метаданных (для ETag без чтения сообщений)"""
+        pipe.set(f"thread:{thread['id']}", json.dumps(thread, default=str))
+        pipe.hset(f"thread_meta:{thread['id']}", mapping=cls._meta_fields(thread))
+
+    def _index_messages(self, target, thread: Dict, start: int):
+        """Добавляет в поисковый индекс сообщения треда, начиная с позиции start"""
+        if self.search_index and len(thread.get("messages") or []) > start:
+            self.search_index.add(target, thread, start)
+
+    @traced("storage.search_messages")
+    def search_messages(self, user_id: str, query: str, limit: int = 20, offset: int = 0) -> Dict:
+        """
+        Полнотекстовый поиск по сообщениям всех тредов пользователя
+        
+        :param query: Поисковый запрос; совпадают сообщения со всеми его словами
+        :return: Словарь total, limit, offset и results (thread_id, message_index, role, snippet)
+        """
+        if self.mode == "redis":
+            return self.search_index.search(user_id, query, limit, offset, self._read_threads)
+        if not self.search_index:
+            raise SearchUnavailableError(f"Full-text search is not supported for {self.engine.dialect.name}")
+        session = self.Session()
+        try:
+            return self.search_index.search(session, user_id, query, limit, offset)
+        finally:
+            session.close()
+
+    def rebuild_search_index(self, batch_size: int = 500) -> int:
+        """
+        Перестраивает поисковый индекс по всем тредам (для истории, записанной до его появления)
+        
+        :return: Количество проиндексированных тредов
+        """
+        count = 0
+        for _, threads in self.iter_threads(batch_size):
+            if self.mode == "redis":
+                for thread in threads:
+                    self.search_index.remove(thread["id"], thread["user_id"])
+                pipe = self.redis.pipeline(transaction=False)
+                for thread in threads:
+                    self._index_messages(pipe, thread, 0)
+                pipe.execute()
+            elif self.search_index:
+                session = self.Session()
+                try:
+                    for thread in threads:
+                        self.search_index.remove(session, thread["id"])
+                        self._index_messages(session, thread, 0)
+                    session.commit()
+                finally:
+                    session.close()
+            count += len(threads)
+        return count
+
+    @cached_property
+    def cold_storage(self):
+        from app.storage.cold_storage import create_cold_storage
+        return create_cold_storage(settings.THREAD_COLD_STORAGE)
+
+    def _read_threads(self, thread_ids: List[str]) -> Dict[str, Dict]:
+        """Треды из Redis для чтения; холодные читаются из холодного хранилища без возврата в Redis"""
+        threads = {}
+        for data in self.redis.mget([f"thread:{thread_id}" for thread_id in thread_ids]):
+            if not data:
+                continue
+            thread = json.loads(data)
+            if thread.get("cold"):
+                thread = self.cold_storage.load(thread["id"], thread.get("version", 0)) or thread
+            threads[thread["id"]] = thread
+        return threads
+
+    def _hydrate(self, thread: Dict) -> Optional[Dict]:
+        return self._rehydrate(thread["id"]) if thread.get("cold") else thread
+
+    def _rehydrate(self, thread_id: str) -> Optional[Dict]:
+        """
+        Возвращает холодный тред в Redis: заглушка заменяется полным тредом
+        из холодного хранилища, после чего холодная копия удаляется.
+        Версия и updated_at обновляются: тред снова активен и не будет сразу
+        перенесен повторно, а удаляется только прочитанная версия копии.
+        """
+        key = f"thread:{thread_id}"
+        with self.redis.pipeline() as pipe:
+            for attempt in range(settings.THREAD_WRITE_RETRIES):
+                try:
+                    pipe.watch(key)
+                    data = pipe.get(key)
+                    if not data:
+                        return None
+                    stub = json.loads(data)
+                    if not stub.get("cold"):
+                        # Уже восстановлен параллельным запросом
+                        return stub
+                    thread = self.cold_storage.load(thread_id, stub.get("version", 0))
+                    if thread is None:
+                        raise ValueError(f"Cold copy of thread {thread_id} is missing")
+                    thread.pop("cold", None)
+                    cold_version = thread.get("version", 0)
+                    thread["version"] = cold_version + 1
+                    thread["updated_at"] = datetime.utcnow()
+                    pipe.multi()
+                    self._redis_write(pipe, thread)
+                    pipe.execute()
+                    self.cold_storage.delete(thread_id, cold_version)
+                    logger.info(f"Thread {thread_id} rehydrated from cold storage")
+                    return thread
+                except WatchError:
+                    self._backoff(attempt)
+        raise ConcurrentUpdateError(f"Thread {thread_id} is being modified concurrently")
+
+    def demote_idle_threads(self, idle_before: datetime, batch_size: int = 500) -> int:
+        """
+        Переносит треды, не изменявшиеся с idle_before, в холодное хранилище,
+        оставляя в Redis небольшую заглушку без сообщений.
+        Возраст определяется по thread_meta, полные треды читаются только для переносимых;
+        для тредов, записанных до появления thread_meta, метаданные создаются при первом проходе.
+        
+        :param idle_before: Граница простоя
+        :param batch_size: Размер пачки SCAN
+        :return: Количество перенесенных тредов
+        """
+        if self.mode != "redis" or not settings.THREAD_COLD_STORAGE:
+            return 0
+        
+        if not self.redis.exists(self.meta_backfill_key):
+            self.backfill_thread_meta(batch_size)
         
-        thread["messages"].append(message)
-        self.update_thread(thread_id, {"messages": thread["messages"]})
+        demoted = 0
+        for meta_keys in self._scan_batches("thread_meta:*", batch_size):
+            pipe = self.redis.pipeline(transaction=False)
+            for meta_key in meta_keys:
+                pipe.hmget(meta_key, "updated_at", "cold")
+            for meta_key, (updated_at, cold) in zip(meta_keys, pipe.execute()):
+                if not updated_at or cold == b"1":
+                    continue
+                if _parse_datetime(updated_at.decode()) >= idle_before:
+                    continue
+                thread_id = meta_key.decode().split(":", 1)[1]
+                if self._demote(thread_id, idle_before):
+                    demoted += 1
+        return demoted
+
+    meta_backfill_key = "thread_tiering:meta_backfilled"
+
+    def backfill_thread_meta(self, batch_size: int = 500) -> int:
+        """
+        Создает thread_meta для тредов, записанных до ее появления
+        
+        :return: Количество тредов, для которых созданы метаданные
+        """
+        created = 0
+        for keys in self._scan_batches("thread:*", batch_size):
+            pipe = self.redis.pipeline(transaction=False)
+            for key in keys:
+                pipe.exists(f"thread_meta:{key.decode().split(':', 1)[1]}")
+            missing = [key for key, exists in zip(keys, pipe.execute()) if not exists]
+            if not missing:
+                continue
+            pipe = self.redis.pipeline(transaction=False)
+            for data in self.redis.mget(missing):
+                if data:
+                    thread = json.loads(data)
+                    # Только если метаданные не появились параллельной записью
+                    fields = [item for pair in self._meta_fields(thread).items() for item in pair]
+                    pipe.eval(_HSET_IF_MISSING, 1, f"thread_meta:{thread['id']}", *fields)
+            created += sum(pipe.execute())
+        # Новые треды всегда пишутся с метаданными - повторный проход не нужен
+        self.redis.set(self.meta_backfill_key, 1)
+        if created:
+            logger.info(f"Created thread_meta for {created} legacy threads")
+        return created
 
+    def _scan_batches(self, pattern: str, batch_size: int) -> Iterator[List[bytes]]:
+        cursor = 0
+        while True:
+            cursor, keys = self.redis.scan(cursor, match=pattern, count=batch_size)
+            if keys:
+                yield keys
+            if not cursor:
+                return
+
+    def _demote(self, thread_id: str, idle_before: datetime) -> bool:
+        key = f"thread:{thread_id}"
+        with self.redis.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                data = pipe.get(key)
+                if not data:
+                    return False
+                thread = json.loads(data)
+                if thread.get("cold") or _parse_datetime(thread["updated_at"]) >= idle_before:
+                    return False
+                
+                self.cold_storage.save(thread)
+                stub = {k: v for k, v in thread.items() if k != "messages"}
+                stub["cold"] = True
+                stub["messages_count"] = len(thread["messages"])
+                pipe.multi()
+                self._redis_write(pipe, stub)
+                # Копии текста сообщений из индекса старого формата
+                pipe.delete(f"search_docs:{thread_id}")
+                pipe.execute()
+                return True
+            except WatchError:
+                # Тред изменился во время переноса - он снова активен
+                self.cold_storage.delete(thread_id, thread.get("version", 0))
+                return False
+
+    @staticmethod
+    def _backoff(attempt: int):
+        """
+        Короткая пауза со случайным разбросом перед повтором записи;
+        после последней попытки паузы нет. Вызывается вне цикла событий:
+        ChatManager выполняет запись через asyncio.to_thread
+        """
+        if attempt + 1 >= settings.THREAD_WRITE_RETRIES:
+            return
+        time.sleep(random.uniform(0, settings.THREAD_WRITE_BACKOFF * (2 ** attempt)))
+
+    def iter_threads(self, batch_size: int = 500, cursor: Optional[str] = None) -> Iterator[Tuple[Optional[str], List[Dict]]]:
+        """
+        Потоковый обход всех тредов пачками с постоянным расходом памяти.
+        Redis: SCAN + MGET, БД: серверный курсор с сортировкой по id.
+        
+        :param batch_size: Размер пачки
+        :param cursor: Позиция для продолжения обхода (из предыдущего вызова)
+        :return: Пары (позиция после пачки, треды пачки); позиция None - обход завершен
+        """
+        if self.mode == "redis":
+            scan_cursor = int(cursor or 0)
+            while True:
+                scan_cursor, keys = self.redis.scan(scan_cursor, match="thread:*", count=batch_size)
+                threads = [json.loads(data) for data in self.redis.mget(keys) if data] if keys else []
+                # Холодные треды выгружаются целиком, без возврата в Redis
+                threads = [
+                    (self.cold_storage.load(thread["id"], thread.get("version", 0)) or thread)
+                    if thread.get("cold") else thread
+                    for thread in threads
+                ]
+                if threads or not scan_cursor:
+                    yield (str(scan_cursor) if scan_cursor else None), threads
+                if not scan_cursor:
+                    return
+        else:
+            session = self.Session()
+            try:
+                query = session.query(ThreadModel).order_by(ThreadModel.id)
+                if cursor:
+                    query = query.filter(ThreadModel.id > cursor)
+                batch = []
+                for row in query.execution_options(stream_results=True).yield_per(batch_size):
+                    batch.append(self._model_to_dict(row))
+                    if len(batch) >= batch_size:
+                        yield batch[-1]["id"], batch
+                        batch = []
+                yield None, batch
+            finally:
+                session.close()
+
+    def bulk_upsert(self, threads: List[Dict]):
+        """
+        Запись пачки тредов как есть (перезапись существующих):
+        pipeline в Redis или одна транзакция в БД
+        """
+        if not threads:
+            return
+        
+        if self.mode == "redis":
+            # Индекс перестраивается целиком: треды перезаписываются как есть
+            for thread in threads:
+                self.search_index.remove(thread["id"], thread["user_id"])
+            pipe = self.redis.pipeline(transaction=False)
+            for thread in threads:
+                self._redis_write(pipe, thread)
+                if not thread.get("cold"):
+                    self._index_messages(pipe, thread, 0)
+            pipe.execute()
+        else:
+            rows = [{
+                "id": thread["id"],
+                "user_id": thread["user_id"],
+                "title": thread.get("title"),
+                "created_at": _parse_datetime(thread.get("created_at")),
+                "updated_at": _parse_datetime(thread.get("updated_at")),
+                "messages": thread.get("messages") or [],
+                "provider": thread.get("provider"),
+                "version": thread.get("version") or 0
+            } for thread in threads]
+            session = self.Session()
+            try:
+                session.query(ThreadModel).filter(
+                    ThreadModel.id.in_([row["id"] for row in rows])
+                ).delete(synchronize_session=False)
+                session.bulk_insert_mappings(ThreadModel, rows)
+                if self.search_index:
+                    for thread in threads:
+                        self.search_index.remove(session, thread["id"])
+                        self._index_messages(session, thread, 0)
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+            finally:
+                session.close()
+
+    @traced("storage.list_threads")
     def list_threads(self, user_id: str) -> List[Dict]:
         if self.mode == "redis":
             keys = self.redis.keys("thread:*")
@@ -122,4 +696,29 @@ class ThreadStorage:
                 "title": t.title,
                 "created_at": t.created_at,
                 "updated_at": t.updated_at
-            } for t in threads]
\ No newline at end of file
+            } for t in threads]
+
+    @staticmethod
+    def _model_to_dict(thread: ThreadModel) -> Dict:
+        return {
+            "id": thread.id,
+            "user_id": thread.user_id,
+            "title": thread.title,
+            "created_at": thread.created_at,
+            "updated_at": thread.updated_at,
+            "messages": thread.messages,
+            "provider": thread.provider,
+            "version": thread.version
+        }
+
+    @staticmethod
+    def _row_values(thread: Dict) -> Dict:
+        """Значения столбцов для записи треда в БД"""
+        return {
+            "user_id": thread["user_id"],
+            "title": thread["title"],
+            "updated_at": thread["updated_at"],
+            "messages": thread["messages"],
+            "provider": thread["provider"],
+            "version": thread["version"]
+        }
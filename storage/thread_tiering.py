@@ -0,0 +1,45 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import Optional
+from app.storage.thread_storage import ThreadStorage
+from app.utils.config import settings
+from app.utils.logger import logger
+
+
+class ThreadTiering:
+    """
+    Фоновый перенос неактивных тредов из Redis в холодное хранилище.
+    За один интервал проход выполняет только один воркер (блокировка в Redis).
+    """
+
+    lock_key = "thread_tiering:lock"
+
+    def __init__(self, thread_storage: ThreadStorage):
+        self.thread_storage = thread_storage
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def run_once(self) -> int:
+        interval = settings.THREAD_TIERING_INTERVAL_SECONDS
+        if not self.thread_storage.redis.set(self.lock_key, 1, nx=True, ex=interval):
+            return 0
+        idle_before = datetime.utcnow() - timedelta(hours=settings.THREAD_COLD_AFTER_HOURS)
+        return self.thread_storage.demote_idle_threads(idle_before)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.THREAD_TIERING_INTERVAL_SECONDS)
+            try:
+                demoted = await asyncio.to_thread(self.run_once)
+                if demoted:
+                    logger.info(f"Moved {demoted} idle threads to cold storage")
+            except Exception as e:
+                logger.error(f"Thread tiering error: {str(e)}")
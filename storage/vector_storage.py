@@ -0,0 +1,158 @@
+import os
+import fcntl
+import json
+import shutil
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+import numpy as np
+from app.utils.config import settings
+
+
+class VectorStorage:
+    """
+    Векторный индекс на NumPy с отображением в память.
+
+    Для каждого пространства имен (треда или пользователя) хранится каталог:
+    vectors.f32 - нормированные векторы float32 подряд, chunks.jsonl - тексты
+    фрагментов в том же порядке, meta.json - размерность векторов.
+    Векторы дописываются в конец файла, поиск читает его через np.memmap,
+    поэтому индекс не загружается в память целиком. Запись и удаление
+    выполняются под блокировкой flock файла lock пространства имен.
+    """
+
+    def __init__(self, base_path: Optional[str] = None):
+        self.base_path = base_path or os.path.join(settings.STORAGE_PATH, "vectors")
+
+    def _path(self, namespace: str, name: str = "") -> str:
+        return os.path.join(self.base_path, namespace, name)
+
+    def _dimension(self, namespace: str) -> Optional[int]:
+        meta_path = self._path(namespace, "meta.json")
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, "r", encoding="utf-8") as f:
+            return json.load(f)["dim"]
+
+    @contextmanager
+    def _locked(self, namespace: str):
+        """Межпроцессная блокировка пространства имен"""
+        lock_path = self._path(namespace, "lock")
+        while True:
+            os.makedirs(self._path(namespace), exist_ok=True)
+            f = open(lock_path, "a")
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                # Пока ждали блокировку, каталог мог быть удален: повторяем
+                if os.path.exists(lock_path) and os.stat(lock_path).st_ino == os.fstat(f.fileno()).st_ino:
+                    break
+            except Exception:
+                pass
+            fcntl.flock(f, fcntl.LOCK_UN)
+            f.close()
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+            f.close()
+
+    def _align(self, namespace: str, dim: int):
+        """Отбрасывает хвосты файлов, записанные не полностью (сбой между записями)"""
+        vectors_path = self._path(namespace, "vectors.f32")
+        chunks_path = self._path(namespace, "chunks.jsonl")
+        count = self.count(namespace)
+        if os.path.exists(vectors_path) and os.path.getsize(vectors_path) != count * dim * 4:
+            os.truncate(vectors_path, count * dim * 4)
+        if not os.path.exists(chunks_path):
+            return
+        with open(chunks_path, "rb+") as f:
+            offset = 0
+            for row, line in enumerate(f):
+                if row >= count or not line.endswith(b"\n"):
+                    f.truncate(offset)
+                    break
+                offset += len(line)
+
+    def count(self, namespace: str) -> int:
+        dim = self._dimension(namespace)
+        vectors_path = self._path(namespace, "vectors.f32")
+        if not dim or not os.path.exists(vectors_path):
+            return 0
+        return os.path.getsize(vectors_path) // (dim * 4)
+
+    def add(self, namespace: str, vectors: np.ndarray, chunks: List[Dict]):
+        """
+        Добавляет векторы и соответствующие им фрагменты
+
+        :param namespace: Пространство имен индекса
+        :param vectors: Матрица векторов (n, dim)
+        :param chunks: Метаданные фрагментов (текст, источник)
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(vectors) != len(chunks):
+            raise ValueError("Vectors and chunks count mismatch")
+        if not len(vectors):
+            return
+
+        # Нормируем, чтобы скалярное произведение было косинусной близостью
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.maximum(norms, 1e-12)
+
+        # Фрагменты и векторы дописываются под одной блокировкой: строки
+        # chunks.jsonl соответствуют векторам по порядку
+        with self._locked(namespace):
+            dim = self._dimension(namespace)
+            if dim is None:
+                dim = vectors.shape[1]
+                with open(self._path(namespace, "meta.json"), "w", encoding="utf-8") as f:
+                    json.dump({"dim": dim}, f)
+            elif vectors.shape[1] != dim:
+                raise ValueError(f"Vector dimension {vectors.shape[1]} does not match index dimension {dim}")
+
+            self._align(namespace, dim)
+            with open(self._path(namespace, "chunks.jsonl"), "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(chunk, ensure_ascii=False) + "\n" for chunk in chunks))
+            with open(self._path(namespace, "vectors.f32"), "ab") as f:
+                f.write(vectors.tobytes())
+
+    def search(self, namespace: str, query: np.ndarray, top_k: int) -> List[Dict]:
+        """
+        Ищет фрагменты, ближайшие к вектору запроса
+
+        :param namespace: Пространство имен индекса
+        :param query: Вектор запроса
+        :param top_k: Количество результатов
+        :return: Фрагменты с оценкой близости по убыванию
+        """
+        count = self.count(namespace)
+        if not count:
+            return []
+
+        dim = self._dimension(namespace)
+        matrix = np.memmap(self._path(namespace, "vectors.f32"), dtype=np.float32, mode="r", shape=(count, dim))
+        query = np.asarray(query, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+
+        scores = matrix @ query
+        top_k = min(top_k, count)
+        indices = np.argpartition(-scores, top_k - 1)[:top_k]
+        indices = indices[np.argsort(-scores[indices])]
+
+        wanted = {int(index): float(scores[index]) for index in indices}
+        chunks = {}
+        with open(self._path(namespace, "chunks.jsonl"), "r", encoding="utf-8") as f:
+            for row, line in enumerate(f):
+                if row in wanted:
+                    chunks[row] = json.loads(line)
+                if row >= count:
+                    break
+
+        return [
+            {**chunks[int(index)], "score": wanted[int(index)]}
+            for index in indices if int(index) in chunks
+        ]
+
+    def delete(self, namespace: str):
+        if not os.path.isdir(self._path(namespace)):
+            return
+        with self._locked(namespace):
+            shutil.rmtree(self._path(namespace), ignore_errors=True)
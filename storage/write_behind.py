@@ -0,0 +1,403 @@
+import asyncio
+import fcntl
+import glob
+import json
+import os
+import threading
+import uuid
+from collections import Counter, OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+from app.utils.config import settings
+from app.utils.logger import logger
+
+# Запись журнала: (идентификатор записи, идентификатор треда, сообщение)
+JournalEntry = Tuple[str, str, Dict]
+
+# Снимает блокировку переноса, только если она все еще принадлежит этому воркеру
+_RELEASE_LOCK = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+
+class RedisStreamJournal:
+    """
+    Журнал отложенных записей в Redis.
+
+    thread_writes              - stream записей в порядке подтверждения
+    thread_pending:{thread_id} - те же сообщения по тредам (для чтения своих записей)
+    Обе структуры изменяются в одной транзакции. Stream переживает перезапуск
+    воркеров, поэтому повторное применение не требует отдельного шага.
+    """
+
+    stream_key = "thread_writes"
+    lock_key = "thread_writes:flush_lock"
+
+    def __init__(self, redis):
+        self.redis = redis
+        self._lock_id: Optional[str] = None
+
+    @staticmethod
+    def _pending_key(thread_id: str) -> str:
+        return f"thread_pending:{thread_id}"
+
+    def append(self, messages: List[Tuple[str, Dict]]):
+        pipe = self.redis.pipeline()
+        for thread_id, message in messages:
+            data = json.dumps(message, default=str)
+            pipe.xadd(self.stream_key, {"thread_id": thread_id, "message": data})
+            pipe.rpush(self._pending_key(thread_id), data)
+        pipe.execute()
+
+    def pending(self, thread_id: str) -> List[Dict]:
+        return [json.loads(data) for data in self.redis.lrange(self._pending_key(thread_id), 0, -1)]
+
+    def pending_many(self, thread_ids: List[str]) -> Dict[str, List[Dict]]:
+        pipe = self.redis.pipeline(transaction=False)
+        for thread_id in thread_ids:
+            pipe.lrange(self._pending_key(thread_id), 0, -1)
+        return {
+            thread_id: [json.loads(data) for data in values]
+            for thread_id, values in zip(thread_ids, pipe.execute()) if values
+        }
+
+    def pending_count(self, thread_id: str) -> int:
+        return self.redis.llen(self._pending_key(thread_id))
+
+    def discard(self, thread_id: str):
+        self.redis.delete(self._pending_key(thread_id))
+
+    def acquire_flush(self) -> bool:
+        """Записи переносит один воркер за раз, иначе нарушится порядок сообщений"""
+        lock_id = str(uuid.uuid4())
+        if self.redis.set(self.lock_key, lock_id, nx=True, ex=settings.WRITE_BEHIND_LOCK_SECONDS):
+            self._lock_id = lock_id
+            return True
+        return False
+
+    def release_flush(self):
+        if self._lock_id:
+            self.redis.eval(_RELEASE_LOCK, 1, self.lock_key, self._lock_id)
+        self._lock_id = None
+
+    def read_batch(self, count: int) -> List[JournalEntry]:
+        return [
+            (entry_id.decode(), fields[b"thread_id"].decode(), json.loads(fields[b"message"]))
+            for entry_id, fields in self.redis.xrange(self.stream_key, "-", "+", count=count)
+        ]
+
+    def ack(self, batch: List[JournalEntry]):
+        pipe = self.redis.pipeline()
+        pipe.xdel(self.stream_key, *[entry_id for entry_id, _, _ in batch])
+        # Перенесенные сообщения - первые в списке треда: порядок тот же, что в stream
+        for thread_id, count in Counter(thread_id for _, thread_id, _ in batch).items():
+            pipe.ltrim(self._pending_key(thread_id), count, -1)
+        pipe.execute()
+
+    def recover(self, apply: Callable[[List[Tuple[str, Dict]]], None]) -> int:
+        return 0
+
+
+class FileJournal:
+    """
+    Журнал отложенных записей в append-only файле (SQL-бэкенд без Redis).
+
+    Только для одного процесса (WRITE_BEHIND_SINGLE_WORKER): неперенесенные
+    записи видны лишь процессу, который их принял, а каждый процесс
+    переносит свою очередь сам. При нескольких воркерах следующая реплика
+    могла бы не увидеть предыдущую, а сообщения треда - записаться
+    не по порядку.
+
+    Каждый процесс пишет в свой файл под блокировкой flock и держит
+    неперенесенные записи в памяти. Запись подтверждается после fsync.
+    После каждого подтверждения переноса файл переписывается только
+    с оставшимися записями. Файлы завершившихся процессов (блокировка
+    свободна) применяются при старте.
+
+    Новый файл сначала создается под временным именем (*.tmp) и
+    блокируется, и только затем переименовывается в *.log: восстановление
+    не может увидеть журнал, блокировку которого еще не взяли.
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory or os.path.join(settings.STORAGE_PATH, "write_journal")
+        os.makedirs(self.directory, exist_ok=True)
+        self.path = os.path.join(self.directory, f"{os.getpid()}-{uuid.uuid4().hex[:8]}.log")
+        self._file = self._publish([])
+        self._entries: "OrderedDict[str, Tuple[str, Dict]]" = OrderedDict()
+        self._pending: Dict[str, List[Dict]] = {}
+        # Перенос выполняется в отдельном потоке: усечение не должно пересечься с записью
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _line(thread_id: str, message: Dict) -> str:
+        return json.dumps({"thread_id": thread_id, "message": message}, ensure_ascii=False, default=str) + "\n"
+
+    def _publish(self, entries: List[Tuple[str, Dict]]):
+        """
+        Записывает entries в новый заблокированный файл и атомарно заменяет им журнал
+
+        :return: Открытый файл журнала (блокировка держится, пока он открыт)
+        """
+        tmp_path = f"{self.path[:-len('.log')]}.{uuid.uuid4().hex[:8]}.tmp"
+        f = open(tmp_path, "a", encoding="utf-8")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            if entries:
+                f.write("".join(self._line(thread_id, message) for thread_id, message in entries))
+                f.flush()
+            os.fsync(f.fileno())
+            os.rename(tmp_path, self.path)
+        except Exception:
+            f.close()
+            os.remove(tmp_path)
+            raise
+        return f
+
+    def append(self, messages: List[Tuple[str, Dict]]):
+        lines = [self._line(thread_id, message) for thread_id, message in messages]
+        with self._lock:
+            self._file.write("".join(lines))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            for thread_id, message in messages:
+                self._entries[message["id"]] = (thread_id, message)
+                self._pending.setdefault(thread_id, []).append(message)
+
+    def pending(self, thread_id: str) -> List[Dict]:
+        return list(self._pending.get(thread_id, []))
+
+    def pending_many(self, thread_ids: List[str]) -> Dict[str, List[Dict]]:
+        return {thread_id: self.pending(thread_id) for thread_id in thread_ids if thread_id in self._pending}
+
+    def pending_count(self, thread_id: str) -> int:
+        return len(self._pending.get(thread_id, []))
+
+    def discard(self, thread_id: str):
+        with self._lock:
+            for message in self._pending.pop(thread_id, []):
+                self._entries.pop(message["id"], None)
+
+    def acquire_flush(self) -> bool:
+        return True
+
+    def release_flush(self):
+        pass
+
+    def read_batch(self, count: int) -> List[JournalEntry]:
+        with self._lock:
+            return [
+                (entry_id, thread_id, message)
+                for entry_id, (thread_id, message) in list(self._entries.items())[:count]
+            ]
+
+    def ack(self, batch: List[JournalEntry]):
+        with self._lock:
+            for entry_id, thread_id, _ in batch:
+                if self._entries.pop(entry_id, None) is None:
+                    continue
+                remaining = [m for m in self._pending.get(thread_id, []) if m["id"] != entry_id]
+                if remaining:
+                    self._pending[thread_id] = remaining
+                else:
+                    self._pending.pop(thread_id, None)
+            # Файл переписывается только с оставшимися записями. Старый файл закрывается
+            # после переименования: восстановление, дождавшееся его блокировки, увидит,
+            # что путь указывает уже на новый файл
+            previous = self._file
+            self._file = self._publish(list(self._entries.values()))
+            previous.close()
+
+    def recover(self, apply: Callable[[List[Tuple[str, Dict]]], None]) -> int:
+        """
+        Применяет журналы завершившихся процессов
+
+        :param apply: Групповая запись сообщений (ThreadStorage.add_messages)
+        :return: Количество примененных записей
+        """
+        count = 0
+        for path in glob.glob(os.path.join(self.directory, "*.tmp")):
+            # Недописанный файл упавшего процесса: исходный журнал остался на месте
+            with open(path, "r", encoding="utf-8") as f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                if os.path.exists(path) and os.stat(path).st_ino == os.fstat(f.fileno()).st_ino:
+                    os.remove(path)
+
+        for path in glob.glob(os.path.join(self.directory, "*.log")):
+            if path == self.path:
+                continue
+            try:
+                f = open(path, "r", encoding="utf-8")
+            except FileNotFoundError:
+                continue
+            with f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # Журнал работающего процесса
+                    continue
+                try:
+                    replaced = os.stat(path).st_ino != os.fstat(f.fileno()).st_ino
+                except FileNotFoundError:
+                    replaced = True
+                if replaced:
+                    # Файл уже заменен процессом-владельцем при уплотнении
+                    continue
+                batch = []
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Оборванная последняя строка: запись не была подтверждена
+                        break
+                    batch.append((entry["thread_id"], entry["message"]))
+                    if len(batch) >= settings.WRITE_BEHIND_BATCH_SIZE:
+                        apply(batch)
+                        count += len(batch)
+                        batch = []
+                if batch:
+                    apply(batch)
+                    count += len(batch)
+                os.remove(path)
+        return count
+
+
+class WriteBehindThreadStorage:
+    """
+    Отложенная запись сообщений поверх ThreadStorage.
+
+    add_message/add_messages только фиксируют сообщение в журнале (Redis
+    stream; файл - только для одного воркера без Redis) и сразу возвращают
+    управление.
+    Фоновая задача переносит записи в ThreadStorage пачками через
+    add_messages; сообщения получают id, поэтому повторное применение
+    после сбоя не создает дублей. Чтения дополняются еще не перенесенными
+    сообщениями. Остальные методы делегируются ThreadStorage.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.journal = self._create_journal(storage)
+        self._task: Optional[asyncio.Task] = None
+
+    def __getattr__(self, name):
+        return getattr(self.storage, name)
+
+    @staticmethod
+    def _create_journal(storage):
+        """
+        Общий журнал в Redis; файловый - только для SQL без Redis и одного воркера
+
+        :raises RuntimeError: Если Redis недоступен, а WRITE_BEHIND_SINGLE_WORKER не задан
+        """
+        if storage.mode == "redis":
+            return RedisStreamJournal(storage.redis)
+        from redis import Redis
+        redis = Redis.from_url(str(settings.REDIS_URL), socket_connect_timeout=2, socket_timeout=5)
+        try:
+            redis.ping()
+            return RedisStreamJournal(redis)
+        except Exception as e:
+            if not settings.WRITE_BEHIND_SINGLE_WORKER:
+                raise RuntimeError(
+                    "WRITE_BEHIND_ENABLED with a SQL backend requires Redis for a shared journal "
+                    "or WRITE_BEHIND_SINGLE_WORKER=true"
+                ) from e
+        logger.warning("Write-behind uses a process-local file journal: run a single worker")
+        return FileJournal()
+
+    def add_message(self, thread_id: str, message: Dict):
+        self.add_messages([(thread_id, message)])
+
+    def add_messages(self, messages: List[Tuple[str, Dict]]):
+        for _, message in messages:
+            message.setdefault("id", str(uuid.uuid4()))
+        self.journal.append(messages)
+
+    @staticmethod
+    def _merge(thread: Optional[Dict], pending: List[Dict]) -> Optional[Dict]:
+        if not thread or not pending:
+            return thread
+        written = {message.get("id") for message in thread["messages"]}
+        pending = [message for message in pending if message["id"] not in written]
+        if not pending:
+            return thread
+        return {**thread, "messages": thread["messages"] + pending, "pending": len(pending)}
+
+    def get_thread(self, thread_id: str) -> Optional[Dict]:
+        return self._merge(self.storage.get_thread(thread_id), self.journal.pending(thread_id))
+
+    def get_threads(self, thread_ids: List[str]) -> Dict[str, Dict]:
+        threads = self.storage.get_threads(thread_ids)
+        pending = self.journal.pending_many(list(threads))
+        return {thread_id: self._merge(thread, pending.get(thread_id, [])) for thread_id, thread in threads.items()}
+
+    def get_thread_meta(self, thread_id: str) -> Optional[Dict]:
+        meta = self.storage.get_thread_meta(thread_id)
+        if meta:
+            count = self.journal.pending_count(thread_id)
+            if count:
+                meta["pending"] = str(count)
+        return meta
+
+    def delete_thread(self, thread_id: str) -> bool:
+        self.journal.discard(thread_id)
+        return self.storage.delete_thread(thread_id)
+
+    async def start(self):
+        """Применяет журналы после перезапуска и запускает фоновый перенос"""
+        try:
+            recovered = await asyncio.to_thread(self.journal.recover, self.storage.add_messages)
+            if recovered:
+                logger.info(f"Replayed {recovered} journaled messages")
+        except Exception as e:
+            # Журнал остается на диске и будет применен при следующем старте
+            logger.error(f"Write-behind journal replay error: {str(e)}")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        # Переносим оставшиеся записи до остановки
+        try:
+            while await self.flush():
+                pass
+        except Exception as e:
+            logger.error(f"Write-behind flush error: {str(e)}")
+
+    async def flush(self) -> int:
+        """
+        Переносит одну пачку записей из журнала в хранилище
+
+        :return: Количество перенесенных записей
+        """
+        if not await asyncio.to_thread(self.journal.acquire_flush):
+            return 0
+        try:
+            batch = await asyncio.to_thread(self.journal.read_batch, settings.WRITE_BEHIND_BATCH_SIZE)
+            if batch:
+                await asyncio.to_thread(
+                    self.storage.add_messages,
+                    [(thread_id, message) for _, thread_id, message in batch]
+                )
+                await asyncio.to_thread(self.journal.ack, batch)
+            return len(batch)
+        finally:
+            await asyncio.to_thread(self.journal.release_flush)
+
+    async def _run(self):
+        while True:
+            try:
+                flushed = await self.flush()
+            except Exception as e:
+                logger.error(f"Write-behind flush error: {str(e)}")
+                flushed = 0
+            if flushed < settings.WRITE_BEHIND_BATCH_SIZE:
+                await asyncio.sleep(settings.WRITE_BEHIND_FLUSH_INTERVAL_SECONDS)
@@ -0,0 +1,23 @@
+import importlib.util
+import logging
+import os
+import sys
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Модули импортируются как пакет app (в контейнере проект лежит в /app)
+if "app" not in sys.modules:
+    package = types.ModuleType("app")
+    package.__path__ = [ROOT]
+    sys.modules["app"] = package
+
+# Модуль логирования в дереве отсутствует - подставляем стандартный логгер
+if importlib.util.find_spec("app.utils.logger") is None:
+    logger_module = types.ModuleType("app.utils.logger")
+    logger_module.logger = logging.getLogger("datarex")
+    sys.modules["app.utils.logger"] = logger_module
+
+# Обязательные настройки без .env
+for name in ("SECRET_KEY", "GIGA_API_KEY", "YANDEX_API_KEY", "YANDEX_FOLDER_ID", "YANDEX_VISION_API_KEY"):
+    os.environ.setdefault(name, "test")
@@ -0,0 +1,106 @@
+import glob
+import os
+from app.storage.write_behind import FileJournal
+
+
+def _message(index: int) -> dict:
+    return {"id": f"m{index}", "role": "user", "content": f"message {index}"}
+
+
+def _crash(journal: FileJournal):
+    """Процесс завершился без переноса: файл остается, блокировка снимается"""
+    journal._file.close()
+
+
+def _collect(journal: FileJournal):
+    applied = []
+    count = journal.recover(applied.extend)
+    return count, applied
+
+
+def test_recover_replays_journal_of_stopped_process(tmp_path):
+    crashed = FileJournal(str(tmp_path))
+    crashed.append([("t1", _message(1)), ("t2", _message(2))])
+    crashed.append([("t1", _message(3))])
+    _crash(crashed)
+
+    count, applied = _collect(FileJournal(str(tmp_path)))
+
+    assert count == 3
+    assert applied == [("t1", _message(1)), ("t2", _message(2)), ("t1", _message(3))]
+    assert not os.path.exists(crashed.path)
+
+
+def test_recover_skips_journal_of_running_process(tmp_path):
+    running = FileJournal(str(tmp_path))
+    running.append([("t1", _message(1))])
+
+    count, applied = _collect(FileJournal(str(tmp_path)))
+
+    assert count == 0
+    assert applied == []
+    assert os.path.exists(running.path)
+    assert running.pending("t1") == [_message(1)]
+
+
+def test_ack_compacts_journal(tmp_path):
+    journal = FileJournal(str(tmp_path))
+    journal.append([("t1", _message(1)), ("t1", _message(2)), ("t2", _message(3))])
+
+    journal.ack(journal.read_batch(2))
+
+    with open(journal.path, encoding="utf-8") as f:
+        assert len(f.readlines()) == 1
+    assert journal.pending("t1") == []
+    assert journal.pending("t2") == [_message(3)]
+
+    # После сбоя применяются только неперенесенные записи
+    _crash(journal)
+    count, applied = _collect(FileJournal(str(tmp_path)))
+    assert count == 1
+    assert applied == [("t2", _message(3))]
+
+
+def test_recover_ignores_torn_last_line(tmp_path):
+    crashed = FileJournal(str(tmp_path))
+    crashed.append([("t1", _message(1))])
+    crashed._file.write('{"thread_id": "t1", "mess')
+    crashed._file.flush()
+    _crash(crashed)
+
+    count, applied = _collect(FileJournal(str(tmp_path)))
+
+    assert count == 1
+    assert applied == [("t1", _message(1))]
+
+
+def test_failed_replay_keeps_journal(tmp_path):
+    crashed = FileJournal(str(tmp_path))
+    crashed.append([("t1", _message(1))])
+    _crash(crashed)
+
+    def apply(batch):
+        raise RuntimeError("storage unavailable")
+
+    journal = FileJournal(str(tmp_path))
+    try:
+        journal.recover(apply)
+    except RuntimeError:
+        pass
+    assert os.path.exists(crashed.path)
+
+    count, applied = _collect(journal)
+    assert count == 1
+    assert applied == [("t1", _message(1))]
+
+
+def test_recover_removes_abandoned_temp_files(tmp_path):
+    journal = FileJournal(str(tmp_path))
+    abandoned = tmp_path / "1-deadbeef.cafebabe.tmp"
+    abandoned.write_text('{"thread_id": "t1", "message": {"id": "m1"}}\n', encoding="utf-8")
+
+    count, applied = _collect(journal)
+
+    assert count == 0
+    assert not abandoned.exists()
+    assert glob.glob(str(tmp_path / "*.log")) == [journal.path]
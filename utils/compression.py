@@ -0,0 +1,41 @@
+# utils/compression.py
+from starlette.datastructures import Headers
+
+# Потоковые ответы: сжатие буферизует их до конца ответа
+STREAMING_MEDIA_TYPES = ("application/x-ndjson", "text/event-stream")
+
+_DIRECT_SEND = "selective_compression.send"
+
+
+class SelectiveCompressionMiddleware:
+    """
+    Сжатие ответов указанным middleware (GZip/Brotli), кроме потоковых типов.
+
+    Ответ приложения идет через компрессор, но если Content-Type ответа
+    входит в excluded_media_types, сообщения отправляются клиенту напрямую,
+    минуя компрессор, и каждый фрагмент уходит сразу.
+    """
+
+    def __init__(self, app, compressor_class, excluded_media_types=STREAMING_MEDIA_TYPES, **options):
+        self.app = app
+        self.excluded_media_types = tuple(excluded_media_types)
+        self.compressor = compressor_class(self._downstream, **options)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        await self.compressor({**scope, _DIRECT_SEND: send}, receive, send)
+
+    async def _downstream(self, scope, receive, send):
+        direct_send = scope[_DIRECT_SEND]
+        bypass = False
+
+        async def route(message):
+            nonlocal bypass
+            if message["type"] == "http.response.start":
+                media_type = Headers(raw=message["headers"]).get("content-type", "").split(";")[0].strip()
+                bypass = media_type in self.excluded_media_types
+            await (direct_send if bypass else send)(message)
+
+        await self.app(scope, receive, route)
@@ -1,6 +1,6 @@
 import os
 from dotenv import load_dotenv
-from pydantic import BaseSettings, Field, AnyUrl
+from pydantic import BaseSettings, Field, AnyUrl, validator
 
 load_dotenv()
 
@@ -10,6 +10,8 @@ class Settings(BaseSettings):
     DEBUG: bool = Field(False, env="DEBUG")
     SECRET_KEY: str = Field(..., env="SECRET_KEY")
     STORAGE_PATH: str = "storage"
+    WARMUP_ON_STARTUP: bool = Field(False, env="WARMUP_ON_STARTUP")
+    DEFAULT_PROVIDER: str = Field("gigachain", env="DEFAULT_PROVIDER")  # gigachain, yandexgpt
     
     # Настройки GigaChain
     GIGA_API_KEY: str = Field(..., env="GIGA_API_KEY")
@@ -17,6 +19,23 @@ class Settings(BaseSettings):
     GIGA_TEMPERATURE: float = 0.7
     GIGA_TOP_P: float = 0.85
     GIGA_MAX_TOKENS: int = 1024
+    GIGA_SCOPE: str = "GIGACHAT_API_PERS"
+    
+    # Общий токен доступа GigaChat: обновление заранее, до истечения
+    GIGA_TOKEN_REFRESH_MARGIN_SECONDS: int = 300
+    GIGA_TOKEN_MIN_TTL_SECONDS: int = 30
+    GIGA_TOKEN_LOCK_SECONDS: int = 30
+    GIGA_TOKEN_RETRY_SECONDS: int = 10
+    
+    # Уровни моделей GigaChat и правила маршрутизации (по умолчанию все запросы идут в GIGA_MODEL)
+    GIGA_MODEL_TIERING: bool = Field(False, env="GIGA_MODEL_TIERING")
+    GIGA_MODEL_LITE: str = "GigaChat"
+    GIGA_MODEL_PRO: str = "GigaChat-Pro"
+    GIGA_MODEL_MAX: str = "GigaChat-Max"
+    GIGA_LITE_MAX_PROMPT_TOKENS: int = 150
+    GIGA_PRO_MAX_PROMPT_TOKENS: int = 1500
+    GIGA_LITE_MAX_OUTPUT_TOKENS: int = 512
+    GIGA_PRO_MAX_OUTPUT_TOKENS: int = 2048
     
     # Настройки YandexGPT
     YANDEX_API_KEY: str = Field(..., env="YANDEX_API_KEY")
@@ -29,10 +48,86 @@ class Settings(BaseSettings):
     # Базы данных
     REDIS_URL: AnyUrl = Field("redis://localhost:6379/0", env="REDIS_URL")
     DATABASE_URL: str = Field("sqlite:///storage/database.db", env="DATABASE_URL")
+    THREAD_WRITE_RETRIES: int = 10
+    THREAD_WRITE_BACKOFF: float = 0.005
+    SEARCH_SNIPPET_CHARS: int = 160
+    
+    # Отложенная запись сообщений: журнал в Redis stream и фоновый перенос в хранилище.
+    # Для SQL-бэкенда журнал тоже ведется в Redis (REDIS_URL). Файловый журнал
+    # виден только своему процессу, поэтому без Redis он допускается лишь
+    # при явном WRITE_BEHIND_SINGLE_WORKER (один воркер uvicorn)
+    WRITE_BEHIND_ENABLED: bool = Field(False, env="WRITE_BEHIND_ENABLED")
+    WRITE_BEHIND_SINGLE_WORKER: bool = Field(False, env="WRITE_BEHIND_SINGLE_WORKER")
+    WRITE_BEHIND_BATCH_SIZE: int = 200
+    WRITE_BEHIND_FLUSH_INTERVAL_SECONDS: float = 0.05
+    WRITE_BEHIND_LOCK_SECONDS: int = 30
+    
+    # Холодное хранение неактивных тредов (только для Redis): "file" или URL SQLAlchemy
+    THREAD_COLD_STORAGE: str = Field("", env="THREAD_COLD_STORAGE")
+    THREAD_COLD_AFTER_HOURS: int = 24 * 14
+    THREAD_TIERING_INTERVAL_SECONDS: int = 3600
     
     # Ограничения
     MAX_CONTEXT_TOKENS: int = 8000
     MAX_FILE_SIZE_MB: int = 20
+    COMPRESSION_MIN_SIZE: int = 1024
+    MAX_ATTACHMENTS: int = 10
+    ATTACHMENT_CONCURRENCY: int = 4
+    
+    # Контроль допуска (load shedding)
+    LOAD_SHEDDING_ENABLED: bool = True
+    LATENCY_SLO_SECONDS: float = 20.0
+    PROVIDER_CAPACITY: int = 16
+    LOAD_LATENCY_EWMA_ALPHA: float = 0.2
+    
+    # WebSocket-канал чата
+    WS_AUTH_TIMEOUT_SECONDS: float = 10.0
+    WS_HEARTBEAT_SECONDS: float = 20.0
+    WS_IDLE_TIMEOUT_SECONDS: float = 60.0
+    WS_SEND_QUEUE_SIZE: int = 256
+    WS_MAX_CONCURRENT_REQUESTS: int = 8
+    
+    # Трассировка запросов
+    TRACE_SAMPLE_RATE: float = Field(0.0, env="TRACE_SAMPLE_RATE")
+    TRACE_SLOW_REQUEST_MS: int = 5000
+    TRACE_EXPORT_PATH: str = ""
+    
+    # RAG по загруженным документам
+    RAG_ENABLED: bool = True
+    RAG_MIN_DOCUMENT_CHARS: int = 2000
+    RAG_CHUNK_SIZE: int = 1200
+    RAG_CHUNK_OVERLAP: int = 200
+    RAG_TOP_K: int = 4
+    RAG_EMBEDDING_PROVIDER: str = "local"  # local, gigachain
+    RAG_LOCAL_EMBEDDING_DIM: int = 512
+    
+    # Фоновые задачи анализа изображений
+    JOB_TTL_SECONDS: int = 3600
+    JOB_QUEUE_MAX_LENGTH: int = 1000
+    JOB_MAX_WAIT_SECONDS: int = 30
+    JOB_LEASE_SECONDS: int = 60
+    # Обработчики в API-процессе; по умолчанию анализ выполняют отдельные процессы
+    IMAGE_ANALYSIS_WORKERS: int = Field(0, env="IMAGE_ANALYSIS_WORKERS")
+    IMAGE_WORKER_CONCURRENCY: int = Field(2, env="IMAGE_WORKER_CONCURRENCY")
+    
+    # Пакетная отправка сообщений
+    BATCH_MAX_ITEMS: int = 500
+    BATCH_CONCURRENCY: int = 8
+    BATCH_MAX_CONCURRENCY: int = 32
+    BATCH_WRITE_SIZE: int = 50
+    
+    # Кеш проверенных токенов
+    AUTH_CACHE_SIZE: int = 10000
+    AUTH_CACHE_MAX_TTL_SECONDS: int = 300
+    AUTH_REVOCATION_SYNC_SECONDS: float = 5.0
+    AUTH_REDIS_TIMEOUT_SECONDS: float = 0.5
+    
+    @validator("RAG_EMBEDDING_PROVIDER")
+    def check_embedding_provider(cls, value):
+        # Эмбеддинги есть только у локальной модели и GigaChain
+        if value not in ("local", "gigachain"):
+            raise ValueError("RAG_EMBEDDING_PROVIDER must be 'local' or 'gigachain'")
+        return value
     
     class Config:
         env_file = ".env"
@@ -1,8 +1,48 @@
 # utils/monitoring.py
-from prometheus_client import Counter, Histogram, make_asgi_app
+import json
+import sys
+import time
+from prometheus_client import Counter, Gauge, Histogram, make_asgi_app
 
 REQUEST_COUNT = Counter('http_requests_total', 'Total HTTP Requests')
 REQUEST_LATENCY = Histogram('http_request_latency_seconds', 'HTTP request latency')
+STARTUP_STAGE_SECONDS = Gauge('app_startup_stage_seconds', 'Duration of worker startup stages', ['stage'])
+REQUESTS_SHED = Counter('requests_shed_total', 'Requests rejected by admission control', ['provider'])
+TIME_TO_READY = Gauge('app_time_to_ready_seconds', 'Worker time from import to ready')
+
+class StartupProfiler:
+    """
+    Профиль запуска воркера: длительность этапов от импорта приложения
+    до готовности принимать запросы. Для разбора по отдельным модулям
+    используйте python -X importtime main.py.
+    """
+    
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.last = self.started
+        self.modules_at_start = len(sys.modules)
+        self.stages = []
+    
+    def mark(self, stage: str):
+        now = time.perf_counter()
+        self.stages.append((stage, now - self.last))
+        STARTUP_STAGE_SECONDS.labels(stage=stage).set(now - self.last)
+        self.last = now
+    
+    def report(self) -> dict:
+        total = self.last - self.started
+        TIME_TO_READY.set(total)
+        return {
+            "time_to_ready_seconds": round(total, 4),
+            "stages": {stage: round(duration, 4) for stage, duration in self.stages},
+            "modules_loaded": len(sys.modules) - self.modules_at_start
+        }
+    
+    def log_report(self, logger):
+        logger.info(f"Startup profile: {json.dumps(self.report())}")
+
+startup_profiler = StartupProfiler()
+
 def setup_metrics(app):
     metrics_app = make_asgi_app()
     app.mount("/metrics", metrics_app)
@@ -0,0 +1,133 @@
+# utils/tracing.py
+import functools
+import inspect
+import json
+import random
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional
+from app.utils.config import settings
+from app.utils.logger import logger
+
+_current_trace: ContextVar[Optional["Trace"]] = ContextVar("current_trace", default=None)
+
+
+class Trace:
+    """Трассировка одного запроса: список этапов с длительностями"""
+
+    def __init__(self, name: str):
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.started = time.perf_counter()
+        self.spans: List[Dict] = []
+        self.depth = 0
+
+    def add_span(self, name: str, started: float, depth: int, error: Optional[str] = None):
+        span = {
+            "name": name,
+            "start_ms": round((started - self.started) * 1000, 2),
+            "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+            "depth": depth
+        }
+        if error:
+            span["error"] = error
+        self.spans.append(span)
+
+    def to_dict(self) -> Dict:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "duration_ms": round((time.perf_counter() - self.started) * 1000, 2),
+            "spans": sorted(self.spans, key=lambda span: span["start_ms"])
+        }
+
+
+def current_trace_id() -> Optional[str]:
+    trace = _current_trace.get()
+    return trace.trace_id if trace else None
+
+
+@contextmanager
+def span(name: str):
+    """
+    Замер этапа запроса. Вне трассируемого запроса ничего не делает.
+
+    Пример:
+        with span("storage.get_thread"):
+            thread = storage.get_thread(thread_id)
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+
+    started = time.perf_counter()
+    depth = trace.depth
+    trace.depth += 1
+    error = None
+    try:
+        yield
+    except Exception as e:
+        error = type(e).__name__
+        raise
+    finally:
+        trace.depth = depth
+        trace.add_span(name, started, depth, error)
+
+
+def traced(name: str) -> Callable:
+    """Декоратор для замера синхронных и асинхронных функций"""
+    def decorator(func: Callable) -> Callable:
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if _current_trace.get() is None:
+                    return await func(*args, **kwargs)
+                with span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current_trace.get() is None:
+                return func(*args, **kwargs)
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _export(trace: Trace):
+    """Пишет трассировку в журнал медленных запросов и/или в файл JSON Lines"""
+    data = trace.to_dict()
+    if data["duration_ms"] >= settings.TRACE_SLOW_REQUEST_MS:
+        logger.warning(f"Slow request: {json.dumps(data, ensure_ascii=False)}")
+    if settings.TRACE_EXPORT_PATH:
+        try:
+            with open(settings.TRACE_EXPORT_PATH, "a", encoding="utf-8") as f:
+                f.write(json.dumps(data, ensure_ascii=False) + "\n")
+        except OSError as e:
+            logger.error(f"Trace export error: {str(e)}")
+
+
+def setup_tracing(app):
+    """Трассировка доли запросов TRACE_SAMPLE_RATE; при 0 middleware не подключается"""
+    if settings.TRACE_SAMPLE_RATE <= 0:
+        return
+
+    @app.middleware("http")
+    async def trace_requests(request, call_next):
+        if random.random() >= settings.TRACE_SAMPLE_RATE:
+            return await call_next(request)
+
+        trace = Trace(f"{request.method} {request.url.path}")
+        token = _current_trace.set(trace)
+        try:
+            response = await call_next(request)
+            response.headers["X-Trace-Id"] = trace.trace_id
+            return response
+        finally:
+            _current_trace.reset(token)
+            _export(trace)